@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Backfill chat pair keys for Liberia2USA Express
+Sets the canonical pair_key on chats created before it existed
+"""
+
+import asyncio
+import os
+import sys
+from pymongo import UpdateOne
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.chat_service import chat_pair_key
+
+BATCH_SIZE = 1000
+
+async def backfill_chat_pair_keys():
+    """Set pair_key on every chat that lacks one"""
+
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+
+    taken = {
+        doc["pair_key"]
+        async for doc in database.chats.find({"pair_key": {"$type": "string"}}, {"_id": 0, "pair_key": 1})
+    }
+
+    # Oldest chat of a pair keeps the key; later duplicates stay reachable by id
+    updated = 0
+    duplicates = 0
+    updates = []
+    query = {"pair_key": {"$exists": False}}
+    projection = {"_id": 1, "participants.user_id": 1, "product_id": 1}
+    async for chat in database.chats.find(query, projection).sort("created_at", 1):
+        user_ids = [p["user_id"] for p in chat.get("participants", [])]
+        if len(user_ids) != 2:
+            continue
+        pair_key = chat_pair_key(user_ids[0], user_ids[1], chat.get("product_id"))
+        if pair_key in taken:
+            duplicates += 1
+            continue
+        taken.add(pair_key)
+        updates.append(UpdateOne({"_id": chat["_id"]}, {"$set": {"pair_key": pair_key}}))
+        if len(updates) >= BATCH_SIZE:
+            await database.chats.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+
+    if updates:
+        await database.chats.bulk_write(updates, ordered=False)
+        updated += len(updates)
+
+    print(f"✅ Pair keys backfilled for {updated} chats ({duplicates} duplicate chats left without a key)")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_chat_pair_keys())
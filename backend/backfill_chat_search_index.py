@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Backfill the chat search index for Liberia2USA Express
+Stores keyed word hashes on messages sent before search existed
+"""
+
+import asyncio
+import os
+import sys
+from pymongo import UpdateOne
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from models.chat import ChatMessage
+from services.chat_service import chat_service
+
+BATCH_SIZE = 1000
+
+async def backfill_chat_search_index():
+    """Index every message that has no search tokens yet"""
+
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+
+    indexed = 0
+    updates = []
+    query = {"search_tokens": {"$exists": False}}
+    async for message_doc in database.chat_messages.find(query, {"search_tokens": 0}):
+        message = chat_service.decrypt_message(ChatMessage(**message_doc))
+        search_tokens = chat_service.search_index.tokens(message.chat_id, message.content.text)
+        updates.append(UpdateOne({"_id": message_doc["_id"]}, {"$set": {"search_tokens": search_tokens}}))
+        if len(updates) >= BATCH_SIZE:
+            await database.chat_messages.bulk_write(updates, ordered=False)
+            indexed += len(updates)
+            updates = []
+
+    if updates:
+        await database.chat_messages.bulk_write(updates, ordered=False)
+        indexed += len(updates)
+
+    print(f"✅ Search index backfilled for {indexed} messages")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_chat_search_index())
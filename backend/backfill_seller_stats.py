@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Backfill denormalized seller statistics for Liberia2USA Express
+Recomputes activeProductCount on every seller from the products collection
+"""
+
+import asyncio
+import os
+import sys
+from pymongo import UpdateOne
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+
+async def backfill_active_product_counts():
+    """Recompute activeProductCount for all sellers"""
+    
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+    
+    # Reset every seller, then apply the real counts
+    await database.users.update_many(
+        {"userType": "seller"},
+        {"$set": {"activeProductCount": 0}}
+    )
+    
+    pipeline = [
+        {"$match": {"is_active": True}},
+        {"$group": {"_id": "$seller_id", "count": {"$sum": 1}}}
+    ]
+    
+    updates = []
+    async for result in database.products.aggregate(pipeline):
+        updates.append(UpdateOne(
+            {"id": result["_id"]},
+            {"$set": {"activeProductCount": result["count"]}}
+        ))
+    
+    if updates:
+        await database.users.bulk_write(updates, ordered=False)
+    
+    print(f"✅ Active product counts backfilled for {len(updates)} sellers")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_active_product_counts())
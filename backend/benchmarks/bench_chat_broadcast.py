@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark for serializing a WebSocket event during fan-out
+Compares encoding the event once per recipient with encoding it once per broadcast
+"""
+
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Benchmarks run without the deployment's chat keys
+os.environ.setdefault("CHAT_ALLOW_EPHEMERAL_KEYS", "true")
+
+from models.chat import WSMessage, WSMessageType
+from services.chat_service import ConnectionManager, encode_frame
+
+MEMBERS = 1000
+BROADCASTS = 200
+CHAT_ID = "chat-broadcast"
+
+class NullWebSocket:
+    """WebSocket stand-in that discards frames"""
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, data: str):
+        pass
+
+def make_message() -> WSMessage:
+    return WSMessage(
+        type=WSMessageType.NEW_MESSAGE,
+        data={
+            "chat_id": CHAT_ID,
+            "message": {
+                "id": "6f1d3c2a-8b7e-4f10-9a2d-5c4b3e2f1a09",
+                "chat_id": CHAT_ID,
+                "sender_id": "user-0",
+                "sender_name": "Musu Kollie",
+                "message_type": "text",
+                "content": {"text": "New stock of lappa cloth arrived today, prices unchanged."},
+                "timestamp": datetime.now()
+            }
+        },
+        sender_id="user-0"
+    )
+
+async def build_manager() -> ConnectionManager:
+    manager = ConnectionManager(presence_window=3600)
+    for i in range(MEMBERS):
+        connection = await manager.connect(NullWebSocket(), f"user-{i}")
+        await manager.subscribe_to_chat(connection, CHAT_ID)
+    return manager
+
+def encode_per_recipient(manager: ConnectionManager, message: WSMessage):
+    """The previous behaviour: every recipient re-encodes the event"""
+    for connection_id in manager.chat_subscribers[CHAT_ID]:
+        connection = manager.connections[connection_id]
+        connection.enqueue(message.type, encode_frame(message))
+
+def encode_once(manager: ConnectionManager, message: WSMessage):
+    frame = encode_frame(message)
+    for connection_id in manager.chat_subscribers[CHAT_ID]:
+        connection = manager.connections[connection_id]
+        connection.enqueue(message.type, frame)
+
+async def measure(manager: ConnectionManager, fan_out) -> float:
+    message = make_message()
+    cpu = 0.0
+    for _ in range(BROADCASTS):
+        start = time.process_time()
+        fan_out(manager, message)
+        cpu += time.process_time() - start
+        # Let the writer tasks drain their queues outside the timed region
+        await asyncio.sleep(0)
+    return cpu / BROADCASTS
+
+async def main():
+    manager = await build_manager()
+    per_recipient = await measure(manager, encode_per_recipient)
+    once = await measure(manager, encode_once)
+    
+    print(f"📣 Chat broadcast benchmark ({MEMBERS}-member fan-out)")
+    print(f"   encode per recipient: {per_recipient * 1000:7.2f} ms CPU/broadcast")
+    print(f"   encode once:          {once * 1000:7.2f} ms CPU/broadcast")
+    print(f"   speedup:              {per_recipient / once:7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark for decrypting a chat history page
+Compares legacy base64 ciphertext decrypted serially on the event loop with
+binary ciphertext decrypted in one batch on the thread pool
+"""
+
+import os
+import sys
+import time
+import asyncio
+import base64
+from datetime import datetime
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Benchmarks run without the deployment's chat keys
+os.environ.setdefault("CHAT_ALLOW_EPHEMERAL_KEYS", "true")
+
+from models.chat import ChatMessage, StoredMessageContent, MessageType
+from services.chat_service import ChatService
+
+PAGE_SIZE = 200
+ROUNDS = 50
+SAMPLE_TEXT = "Hi, is the mat still available? I can pick it up in Monrovia on Saturday."
+
+def build_page(service: ChatService, legacy: bool):
+    """Build a history page stored in the legacy or binary format"""
+    messages = []
+    for i in range(PAGE_SIZE):
+        ciphertext = service.encryption.encrypt_message(f"{SAMPLE_TEXT} #{i}")
+        if legacy:
+            content = StoredMessageContent(text=base64.urlsafe_b64encode(base64.urlsafe_b64encode(ciphertext)).decode())
+        else:
+            content = StoredMessageContent(ciphertext=ciphertext)
+        messages.append(ChatMessage(
+            id=str(i), chat_id="chat", sender_id="buyer", sender_name="Buyer",
+            message_type=MessageType.TEXT, content=content, timestamp=datetime.now()
+        ))
+    return messages
+
+def stored_size(messages) -> int:
+    return sum(len(m.content.ciphertext if m.content.ciphertext is not None else m.content.text)
+               for m in messages)
+
+async def measure_binary(service: ChatService) -> float:
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        # Decryption is in place, so every round needs a fresh page
+        page = build_page(service, legacy=False)
+        start = time.perf_counter()
+        await service.decrypt_messages(page)
+        elapsed += time.perf_counter() - start
+    return elapsed / ROUNDS
+
+def measure_legacy(service: ChatService) -> float:
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        page = build_page(service, legacy=True)
+        start = time.perf_counter()
+        for message in page:
+            service.decrypt_message(message)
+        elapsed += time.perf_counter() - start
+    return elapsed / ROUNDS
+
+async def main():
+    service = ChatService()
+    legacy_page = build_page(service, legacy=True)
+    binary_page = build_page(service, legacy=False)
+    plaintext = sum(len(f"{SAMPLE_TEXT} #{i}") for i in range(PAGE_SIZE))
+
+    legacy_seconds = measure_legacy(service)
+    binary_seconds = await measure_binary(service)
+
+    print(f"🔐 Chat history decrypt benchmark ({PAGE_SIZE}-message page)")
+    print(f"   plaintext:            {plaintext:8d} bytes")
+    print(f"   legacy ciphertext:    {stored_size(legacy_page):8d} bytes")
+    print(f"   binary ciphertext:    {stored_size(binary_page):8d} bytes")
+    print(f"   legacy serial decrypt: {legacy_seconds * 1000:7.2f} ms/page (blocks the event loop)")
+    print(f"   binary batch decrypt:  {binary_seconds * 1000:7.2f} ms/page (on the thread pool)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark for chat message fan-out in ConnectionManager
+Measures per-message delivery cost to a two-member chat as the number of
+connected users grows
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Benchmarks run without the deployment's chat keys
+os.environ.setdefault("CHAT_ALLOW_EPHEMERAL_KEYS", "true")
+
+from services.chat_service import ConnectionManager
+from models.chat import WSMessage, WSMessageType
+
+MESSAGES = 2000
+
+class NullWebSocket:
+    """WebSocket stand-in that discards frames"""
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, data: str):
+        pass
+
+async def build_manager(user_count: int) -> ConnectionManager:
+    """Connect user_count users, each subscribed to a chat with one partner"""
+    manager = ConnectionManager(presence_window=3600)
+    for i in range(user_count):
+        user_id = f"user-{i}"
+        connection = await manager.connect(NullWebSocket(), user_id)
+        await manager.subscribe_to_chat(connection, f"chat-{i // 2}")
+    # Run every new writer task up to its idle wait before anything is timed
+    await asyncio.sleep(0)
+    return manager
+
+async def measure(user_count: int) -> float:
+    manager = await build_manager(user_count)
+    message = WSMessage(
+        type=WSMessageType.NEW_MESSAGE,
+        data={"chat_id": "chat-0", "message": {"text": "Is the mat still available?"}},
+        sender_id="user-0"
+    )
+    
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        await manager.send_to_chat("chat-0", message, exclude_user="user-0")
+        # Let the recipient's writer task drain its queue
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    
+    # Stop the writers so idle tasks do not pile up across measurements
+    for connection in list(manager.connections.values()):
+        manager.disconnect(connection)
+    await asyncio.sleep(0)
+    return elapsed / MESSAGES * 1e6
+
+async def main():
+    print("💬 Chat fan-out benchmark (2-member chat)")
+    for user_count in (100, 1000, 10000):
+        per_message_us = await measure(user_count)
+        print(f"   {user_count:>6} connected users: {per_message_us:8.2f} µs/message")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the chat WebSocket wire protocols
+Compares JSON text frames with MessagePack frames for new message and presence events
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Benchmarks run without the deployment's chat keys
+os.environ.setdefault("CHAT_ALLOW_EPHEMERAL_KEYS", "true")
+
+from models.chat import WSMessage, WSMessageType
+from services.chat_service import MSGPACK_PROTOCOL, encode_frame, msgpack
+
+ITERATIONS = 20000
+
+def new_message_event() -> WSMessage:
+    return WSMessage(
+        type=WSMessageType.NEW_MESSAGE,
+        data={
+            "chat_id": "5b2f7e1c-3d4a-4c8b-9e6f-1a2b3c4d5e6f",
+            "message": {
+                "id": "6f1d3c2a-8b7e-4f10-9a2d-5c4b3e2f1a09",
+                "chat_id": "5b2f7e1c-3d4a-4c8b-9e6f-1a2b3c4d5e6f",
+                "sender_id": "3f1c2a7e-9b4d-4a57-8f0e-2d6b1c9e7a10",
+                "sender_name": "Musu Kollie",
+                "message_type": "text",
+                "content": {"text": "Is the lappa cloth still available in blue?"},
+                "status": "sent",
+                "timestamp": datetime.now(),
+                "edited_at": None,
+                "reply_to": None,
+                "is_encrypted": True
+            }
+        },
+        sender_id="3f1c2a7e-9b4d-4a57-8f0e-2d6b1c9e7a10"
+    )
+
+def presence_event() -> WSMessage:
+    return WSMessage(
+        type=WSMessageType.PRESENCE_UPDATE,
+        data={"users": [
+            {"user_id": f"3f1c2a7e-9b4d-4a57-8f0e-2d6b1c9e7a{i:02d}", "is_online": i % 2 == 0}
+            for i in range(5)
+        ]}
+    )
+
+def measure(name: str, message: WSMessage):
+    json_frame = encode_frame(message).encoded(None)
+    packed_frame = encode_frame(message).encoded(MSGPACK_PROTOCOL)
+
+    json_us = min(timeit.repeat(lambda: encode_frame(message).encoded(None),
+                                number=ITERATIONS, repeat=3)) / ITERATIONS * 1e6
+    packed_us = min(timeit.repeat(lambda: encode_frame(message).encoded(MSGPACK_PROTOCOL),
+                                  number=ITERATIONS, repeat=3)) / ITERATIONS * 1e6
+
+    json_bytes = len(json_frame.encode())
+    print(f"   {name}")
+    print(f"      JSON:        {json_bytes:5d} bytes  {json_us:6.2f} µs/encode")
+    print(f"      MessagePack: {len(packed_frame):5d} bytes  {packed_us:6.2f} µs/encode "
+          f"({len(packed_frame) / json_bytes:.0%} of JSON)")
+
+def main():
+    if msgpack is None:
+        print("❌ msgpack is not installed; pip install msgpack to run this benchmark")
+        sys.exit(1)
+
+    print("📦 Chat WebSocket protocol benchmark")
+    measure("new_message", new_message_event())
+    measure("presence_update (5 users)", presence_event())
+
+if __name__ == "__main__":
+    main()
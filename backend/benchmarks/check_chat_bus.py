@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Cross-node check for the Redis chat bus
+Runs two connection managers against an in-process RESP pub/sub server and
+verifies that a chat event sent on one node reaches a socket on the other
+"""
+
+import os
+import sys
+import json
+import asyncio
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Checks run without the deployment's chat keys
+os.environ.setdefault("CHAT_ALLOW_EPHEMERAL_KEYS", "true")
+
+from models.chat import WSMessage, WSMessageType
+from services.chat_bus import RedisBus, RedisConnection
+from services.chat_service import ConnectionManager
+
+CHAT_ID = "chat-bus-check"
+CHANNEL = "chat-bus-check"
+TIMEOUT_SECONDS = 5
+
+class RecordingWebSocket:
+    """WebSocket stand-in that keeps the frames sent to it"""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, data: str):
+        self.frames.append(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        pass
+
+class PubSubServer:
+    """The SUBSCRIBE/PUBLISH subset of Redis, enough for RedisBus"""
+
+    def __init__(self):
+        self.subscribers = {}  # channel -> [writer]
+        self.handlers = []
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{port}/0"
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self.subscribers.get(channel, []))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = RedisConnection(reader, writer)
+        self.handlers.append(asyncio.current_task())
+        try:
+            while True:
+                command, *args = await connection.read_reply()
+                command = command.upper()
+                if command == b"SUBSCRIBE":
+                    for count, channel in enumerate(args, 1):
+                        self.subscribers.setdefault(channel.decode(), []).append(writer)
+                        # [subscribe, channel, subscription count]; the count is an integer reply
+                        writer.write(b"*3\r\n" + connection.encode("subscribe", channel)[4:] + f":{count}\r\n".encode())
+                elif command == b"PUBLISH":
+                    channel, payload = args
+                    receivers = self.subscribers.get(channel.decode(), [])
+                    for receiver in receivers:
+                        receiver.write(connection.encode("message", channel, payload))
+                    writer.write(f":{len(receivers)}\r\n".encode())
+                else:
+                    writer.write(f"-ERR unknown command '{command.decode()}'\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                if writer in writers:
+                    writers.remove(writer)
+            writer.close()
+
+    async def stop(self):
+        self.server.close()
+        for handler in self.handlers:
+            handler.cancel()
+        await asyncio.gather(*self.handlers)
+        await self.server.wait_closed()
+
+async def wait_for(condition, description: str):
+    deadline = asyncio.get_running_loop().time() + TIMEOUT_SECONDS
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError(f"Timed out waiting for {description}")
+        await asyncio.sleep(0.01)
+
+async def check_cross_node_delivery(url: str, server: PubSubServer):
+    node_a = ConnectionManager(presence_window=0, bus=RedisBus(url, CHANNEL))
+    node_b = ConnectionManager(presence_window=0, bus=RedisBus(url, CHANNEL))
+    await node_a.start()
+    await node_b.start()
+    try:
+        await wait_for(lambda: server.subscriber_count(CHANNEL) == 2, "both nodes to subscribe")
+
+        sender_socket, recipient_socket = RecordingWebSocket(), RecordingWebSocket()
+        sender = await node_a.connect(sender_socket, "user-a")
+        recipient = await node_b.connect(recipient_socket, "user-b")
+        await node_a.subscribe_to_chat(sender, CHAT_ID)
+        await node_b.subscribe_to_chat(recipient, CHAT_ID)
+
+        message = WSMessage(
+            type=WSMessageType.NEW_MESSAGE,
+            data={"chat_id": CHAT_ID, "message": {"id": "message-1", "content": {"text": "Hello from node A"}}},
+            sender_id="user-a"
+        )
+        await node_a.send_to_chat(CHAT_ID, message, exclude_user="user-a")
+
+        def delivered():
+            return [frame for frame in recipient_socket.frames if frame["type"] == WSMessageType.NEW_MESSAGE]
+        await wait_for(delivered, "the event on node B")
+        # Give a duplicate the chance to arrive before counting
+        await asyncio.sleep(0.1)
+
+        frames = delivered()
+        assert len(frames) == 1, f"Expected one event on node B, got {len(frames)}"
+        assert frames[0]["data"]["message"]["id"] == "message-1", "Node B received the wrong event"
+        assert not any(
+            frame["type"] == WSMessageType.NEW_MESSAGE for frame in sender_socket.frames
+        ), "The excluded sender received its own event"
+    finally:
+        await node_a.stop()
+        await node_b.stop()
+
+async def main():
+    server = PubSubServer()
+    url = await server.start()
+    try:
+        await check_cross_node_delivery(url, server)
+    except AssertionError as e:
+        print(f"❌ Chat bus check failed: {e}")
+        sys.exit(1)
+    finally:
+        await server.stop()
+
+    print("✅ Chat event sent on node A reached a socket on node B over the Redis bus")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,6 +4,7 @@ Database connection module for Liberia2USA Express
 import os
 from dotenv import load_dotenv
 import motor.motor_asyncio
+from pymongo.errors import OperationFailure
 from urllib.parse import urlparse
 import asyncio
 
@@ -91,6 +92,104 @@ async def close_mongo_connection():
         client.close()
         print("✓ MongoDB connection closed")
 
+# Indexes the API relies on: (collection, keys, options)
+INDEXES = [
+    # Users are looked up by id everywhere; email uniqueness is enforced here
+    ("users", "id", {"unique": True}),
+    ("users", "email", {"unique": True}),
+    ("users", [("userType", 1), ("isVerified", 1), ("createdAt", -1)], {}),
+    
+    # Reset tokens are stored hashed, one per user, and purged once expired
+    ("password_reset_tokens", "token_hash", {"unique": True, "partialFilterExpression": {"token_hash": {"$type": "string"}}}),
+    ("password_reset_tokens", "user_id", {"unique": True}),
+    ("password_reset_tokens", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # Refresh tokens are looked up by hash and purged once expired
+    ("refresh_tokens", "token_hash", {"unique": True}),
+    ("refresh_tokens", "family_id", {}),
+    ("refresh_tokens", "user_id", {}),
+    ("refresh_tokens", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # Revoked access tokens only need to live until the token expires
+    ("revoked_tokens", "jti", {"unique": True}),
+    ("revoked_tokens", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # Chat lists are a user's chats by most recent activity
+    ("chats", [("participants.user_id", 1), ("updated_at", -1)], {}),
+    # At most one chat per pair of users and product; legacy chats without a key are skipped
+    ("chats", "pair_key", {"unique": True, "partialFilterExpression": {"pair_key": {"$type": "string"}}}),
+    
+    # Message history is paged by cursor within a chat
+    ("chat_messages", [("chat_id", 1), ("timestamp", -1), ("id", -1)], {}),
+    
+    # Encrypted messages are searched by keyed word hashes within a chat
+    ("chat_messages", [("chat_id", 1), ("search_tokens", 1), ("timestamp", -1), ("id", -1)], {}),
+    
+    # One delivery cursor per user and chat
+    ("delivery_cursors", [("user_id", 1), ("chat_id", 1)], {"unique": True}),
+    
+    # Attachment metadata, keyed by content hash; old uploads are swept if unreferenced
+    ("chat_media", "id", {"unique": True}),
+    ("chat_media", "created_at", {}),
+    ("chat_messages", "content.media_id", {"partialFilterExpression": {"content.media_id": {"$type": "string"}}}),
+    
+    # Cross-worker chat events only need to outlive change stream delivery
+    ("chat_events", "created_at", {"expireAfterSeconds": 60}),
+    
+    # Shared rate limit counters expire once idle
+    ("rate_limits", "expires_at", {"expireAfterSeconds": 0}),
+]
+
+# Unique indexes that are the only guard against duplicates; startup fails without them.
+# Existing duplicate emails are resolved with dedupe_user_emails.py
+REQUIRED_INDEXES = {
+    ("users", "email"),
+    ("chats", "pair_key"),
+}
+
+# Index exists with the same keys but other options, e.g. a filter added later
+INDEX_CONFLICT_CODES = (85, 86)
+
+def index_key_spec(keys):
+    """Normalize index keys to a list of (field, direction) pairs"""
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return list(keys)
+
+async def replace_conflicting_index(collection, keys, options):
+    """Drop an index built with outdated options and create it again"""
+    key_spec = index_key_spec(keys)
+    for name, info in (await collection.index_information()).items():
+        if name != "_id_" and list(info["key"]) == key_spec:
+            await collection.drop_index(name)
+    await collection.create_index(keys, **options)
+
+async def create_indexes():
+    """Create indexes the API relies on"""
+    if database is None:
+        return
+    
+    failed = 0
+    for collection, keys, options in INDEXES:
+        try:
+            try:
+                await database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                if e.code not in INDEX_CONFLICT_CODES:
+                    raise
+                print(f"🔄 Rebuilding index {collection}.{keys} with updated options")
+                await replace_conflicting_index(database[collection], keys, options)
+        except Exception as e:
+            if (collection, keys) in REQUIRED_INDEXES:
+                raise RuntimeError(
+                    f"Required index {collection}.{keys} could not be created: {e}"
+                ) from e
+            failed += 1
+            print(f"⚠️ Warning: Could not create index {collection}.{keys}: {e}")
+    
+    if not failed:
+        print("✓ Database indexes ensured")
+
 def get_database():
     """Get database instance"""
     return database
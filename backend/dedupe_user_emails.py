@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Deduplicate user emails for Liberia2USA Express
+Frees duplicate emails so the unique users.email index can be built
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+
+async def dedupe_user_emails():
+    """Keep the oldest account per email and move the others off it"""
+
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+
+    pipeline = [
+        {"$sort": {"createdAt": 1, "_id": 1}},
+        {"$group": {"_id": "$email", "users": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+
+    # Later duplicates keep their data but can no longer log in with the email;
+    # bumping tokenVersion ends their existing sessions
+    emails = 0
+    moved = 0
+    async for group in database.users.aggregate(pipeline, allowDiskUse=True):
+        email = group["_id"]
+        for user_id in group["users"][1:]:
+            await database.users.update_one(
+                {"id": user_id},
+                {
+                    "$set": {
+                        "email": f"duplicate+{user_id}@invalid",
+                        "duplicateEmail": email,
+                        "updatedAt": datetime.utcnow()
+                    },
+                    "$inc": {"tokenVersion": 1}
+                }
+            )
+            print(f"⚠️ User {user_id} shared {email} with {group['users'][0]}; email moved aside")
+            moved += 1
+        emails += 1
+
+    print(f"✅ Resolved {emails} duplicated emails ({moved} accounts moved aside)")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(dedupe_user_emails())
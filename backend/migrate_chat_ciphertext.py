@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Migrate encrypted chat messages for Liberia2USA Express
+Rewrites legacy base64 ciphertext strings as BSON binary without decrypting
+"""
+
+import asyncio
+import os
+import sys
+from pymongo import UpdateOne
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.chat_service import ChatEncryption
+
+BATCH_SIZE = 1000
+
+def binary_update(field: str, text: str):
+    """Build the $set for one legacy ciphertext, or None if it is not ciphertext"""
+    try:
+        ciphertext = ChatEncryption.legacy_to_binary(text)
+    except Exception:
+        # Plaintext left behind by a failed encryption
+        return None
+    return {"$set": {f"{field}.ciphertext": ciphertext, f"{field}.text": None}}
+
+async def migrate_collection(collection, message_field: str) -> int:
+    """Convert every legacy ciphertext of text messages stored under message_field"""
+    prefix = f"{message_field}." if message_field else ""
+    content_field = f"{prefix}content"
+    query = {
+        f"{prefix}message_type": "text",
+        f"{content_field}.text": {"$type": "string"},
+        f"{content_field}.ciphertext": None
+    }
+    
+    migrated = 0
+    updates = []
+    async for doc in collection.find(query, {"_id": 1, content_field: 1}):
+        content = doc[message_field]["content"] if message_field else doc["content"]
+        update = binary_update(content_field, content["text"])
+        if update is None:
+            continue
+        updates.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(updates) >= BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+    
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+    return migrated
+
+async def migrate_chat_ciphertext():
+    """Store chat message ciphertext as binary instead of base64 text"""
+    
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+    
+    messages = await migrate_collection(database.chat_messages, "")
+    previews = await migrate_collection(database.chats, "last_message")
+    
+    print(f"✅ Migrated {messages} messages and {previews} chat previews to binary ciphertext")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_chat_ciphertext())
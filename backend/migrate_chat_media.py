@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Migrate inline chat media for Liberia2USA Express
+Moves base64 attachments out of chat messages into blob storage
+"""
+
+import asyncio
+import base64
+import os
+import sys
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.chat_service import chat_service
+
+def parse_data_url(media_url: str):
+    """Split a base64 data URL into (content type, bytes), or None"""
+    header, _, data = media_url.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        return None
+    try:
+        return header[5:-7] or "application/octet-stream", base64.b64decode(data)
+    except Exception:
+        return None
+
+async def single_chunk(data: bytes):
+    yield data
+
+async def migrate_messages(database) -> int:
+    """Replace inline media of every message with a blob reference"""
+    migrated = 0
+    query = {"content.media_url": {"$regex": "^data:"}}
+    async for doc in database.chat_messages.find(query, {"_id": 1, "sender_id": 1, "content.media_url": 1}):
+        parsed = parse_data_url(doc["content"]["media_url"])
+        if parsed is None:
+            print(f"⚠️ Skipping message {doc['_id']}: unreadable media data")
+            continue
+        content_type, data = parsed
+        media = await chat_service.store_media(database, single_chunk(data), content_type, None, doc["sender_id"])
+        await database.chat_messages.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "content.media_id": media["media_id"],
+                "content.media_url": None,
+                "content.media_type": media["media_type"],
+                "content.file_size": media["file_size"],
+                "content.width": media["width"],
+                "content.height": media["height"]
+            }}
+        )
+        migrated += 1
+    return migrated
+
+async def migrate_chat_media():
+    """Store chat attachments in blob storage instead of inline base64"""
+
+    await connect_to_mongo()
+    database = get_database()
+    if database is None:
+        print("❌ Could not connect to database")
+        sys.exit(1)
+
+    messages = await migrate_messages(database)
+    # Previews written before media was dropped from them still carry the data
+    previews = await database.chats.update_many(
+        {"last_message.content.media_url": {"$regex": "^data:"}},
+        {"$unset": {"last_message.content.media_url": ""}}
+    )
+
+    print(f"✅ Moved media of {messages} messages to blob storage and trimmed {previews.modified_count} chat previews")
+    await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_chat_media())
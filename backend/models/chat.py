@@ -1,4 +1,4 @@
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field, validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
@@ -32,10 +32,19 @@ class ChatParticipant(BaseModel):
 
 class MessageContent(BaseModel):
     text: Optional[str] = None
-    media_url: Optional[str] = None  # base64 data for images/videos
+    media_id: Optional[str] = None  # SHA-256 of an attachment uploaded to /api/chat/media
+    media_url: Optional[str] = None  # signed download link, filled in when read
     media_type: Optional[str] = None  # "image/jpeg", "video/mp4", etc.
     filename: Optional[str] = None
     file_size: Optional[int] = None
+    width: Optional[int] = None  # image dimensions, for sizing the thumbnail before it loads
+    height: Optional[int] = None
+
+class StoredMessageContent(MessageContent):
+    """Message content as stored, with encrypted text; never accepted as input"""
+    # Raw Fernet token stored as BSON binary; never serialized in responses
+    ciphertext: Optional[bytes] = Field(None, exclude=True)
+    key_version: Optional[int] = Field(None, exclude=True)  # encryption key of the ciphertext
 
 class ChatMessage(BaseModel):
     id: str
@@ -43,7 +52,7 @@ class ChatMessage(BaseModel):
     sender_id: str
     sender_name: str
     message_type: MessageType
-    content: MessageContent
+    content: StoredMessageContent
     status: MessageStatus = MessageStatus.SENT
     timestamp: datetime
     edited_at: Optional[datetime] = None
@@ -55,6 +64,7 @@ class Chat(BaseModel):
     participants: List[ChatParticipant]
     product_id: Optional[str] = None  # Product being discussed
     product_name: Optional[str] = None
+    pair_key: Optional[str] = None  # sorted participant ids plus product id, unique
     status: ChatStatus = ChatStatus.ACTIVE
     created_at: datetime
     updated_at: datetime
@@ -73,8 +83,35 @@ class MessageCreate(BaseModel):
     content: MessageContent
     reply_to: Optional[str] = None
 
+class ChatPreviewContent(BaseModel):
+    text: Optional[str] = None  # decrypted and truncated for text messages
+    media_type: Optional[str] = None
+
+class ChatPreview(BaseModel):
+    id: str
+    sender_id: str
+    sender_name: str
+    message_type: MessageType
+    content: ChatPreviewContent
+    timestamp: datetime
+
+class ChatSummary(BaseModel):
+    """Compact chat row for the chat list"""
+    id: str
+    participants: List[ChatParticipant]
+    product_id: Optional[str] = None
+    product_name: Optional[str] = None
+    status: ChatStatus = ChatStatus.ACTIVE
+    updated_at: datetime
+    last_message: Optional[ChatPreview] = None
+    unread_count: Dict[str, int] = {}  # only the requesting user's entry
+
+class ChatSearchResponse(BaseModel):
+    messages: List[ChatMessage]
+    has_more: bool
+
 class ChatListResponse(BaseModel):
-    chats: List[Chat]
+    chats: List[ChatSummary]
     total_count: int
     unread_total: int
 
@@ -82,7 +119,7 @@ class ChatMessagesResponse(BaseModel):
     messages: List[ChatMessage]
     chat_info: Chat
     has_more: bool
-    total_count: int
+    total_count: Optional[int] = None
 
 class ReportChat(BaseModel):
     chat_id: str
@@ -96,7 +133,11 @@ class WSMessageType(str, Enum):
     USER_TYPING = "user_typing"
     USER_ONLINE = "user_online"
     USER_OFFLINE = "user_offline"
+    PRESENCE_UPDATE = "presence_update"
     CHAT_UPDATED = "chat_updated"
+    SYNC = "sync"
+    PING = "ping"
+    PONG = "pong"
 
 class WSMessage(BaseModel):
     type: WSMessageType
@@ -14,9 +14,8 @@ class PasswordResetToken(BaseModel):
     id: str
     user_id: str
     email: str
-    token: str
+    token_hash: str  # SHA-256 of the token sent to the user
     expires_at: datetime
-    used: bool = False
     created_at: datetime
 
 class PasswordResetResponse(BaseModel):
@@ -25,6 +25,9 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class UserResponse(BaseModel):
     id: str
     firstName: str
@@ -36,6 +39,15 @@ class UserResponse(BaseModel):
     isVerified: bool = False
     createdAt: datetime
     
+class SellerDirectoryEntry(BaseModel):
+    id: str
+    firstName: str
+    lastName: str
+    location: str
+    isVerified: bool = True
+    activeProductCount: int = 0
+    createdAt: datetime
+    
 class UserInDB(BaseModel):
     id: str
     firstName: str
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
@@ -11,7 +11,11 @@ from models.admin import (
 from models.user import UserResponse
 from models.product import ProductResponse
 from database import get_database
-from server import create_access_token, get_current_user
+from server import create_access_token, get_current_claims, build_token_claims, revoke_account_tokens
+from services.auth_service import issue_refresh_token
+from services.rate_limiter import rate_limiter
+from services.cache import seller_directory_cache
+from services.chat_service import chat_service
 
 router = APIRouter()
 
@@ -30,19 +34,22 @@ ADMIN_PERMISSIONS = {
     ]
 }
 
-async def get_current_admin(current_user_id: str = Depends(get_current_user)):
-    """Get current admin user and verify admin permissions"""
-    database = get_database()
-    
-    # Check if user is an admin
-    admin = await database.admins.find_one({"id": current_user_id, "isActive": True})
-    if not admin:
+async def get_current_admin(claims: dict = Depends(get_current_claims)):
+    """Get current admin user and verify admin permissions from the token claims"""
+    if claims.get("account") != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
     
-    return admin
+    return {
+        "id": claims["sub"],
+        "email": claims.get("email"),
+        "firstName": claims.get("firstName"),
+        "lastName": claims.get("lastName"),
+        "role": claims.get("role"),
+        "permissions": claims.get("permissions", [])
+    }
 
 async def check_admin_permission(permission: str, admin: dict):
     """Check if admin has specific permission"""
@@ -69,8 +76,10 @@ async def log_admin_activity(database, admin_id: str, admin_name: str, action: s
 
 # Admin Authentication
 @router.post("/login", response_model=dict)
-async def admin_login(login_data: AdminLogin):
+async def admin_login(login_data: AdminLogin, http_request: Request):
     """Admin login"""
+    await rate_limiter.check("admin_login", http_request, email=login_data.email)
+    
     database = get_database()
     
     # Find admin by email
@@ -89,7 +98,8 @@ async def admin_login(login_data: AdminLogin):
         )
     
     # Create access token
-    access_token = create_access_token(data={"sub": admin["id"]})
+    access_token = create_access_token(data=build_token_claims(admin, "admin"))
+    refresh_token = await issue_refresh_token(database, admin["id"], "admin")
     
     # Log activity
     await log_admin_activity(
@@ -109,7 +119,8 @@ async def admin_login(login_data: AdminLogin):
             "role": admin["role"],
             "permissions": admin["permissions"]
         },
-        "token": access_token
+        "token": access_token,
+        "refresh_token": refresh_token
     }
 
 @router.get("/me", response_model=dict)
@@ -308,11 +319,13 @@ async def moderate_user(
         update_data["isBanned"] = False
         update_data.pop("suspendedUntil", None)
     
-    # Update user
+    # Update user and revoke tokens carrying the old verification/status claims
     await database.users.update_one(
         {"id": user_id},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"tokenVersion": 1}}
     )
+    revoke_account_tokens("user", user_id)
+    seller_directory_cache.clear()
     
     # Log activity
     await log_admin_activity(
@@ -423,19 +436,33 @@ async def moderate_product(
             detail="Product not found"
         )
     
-    # Apply moderation action
+    # Apply moderation action; the pre-image tells us how the active count changes
+    previous = None
     if action_data.action == "approve":
-        await database.products.update_one(
+        previous = await database.products.find_one_and_update(
             {"id": product_id},
             {"$set": {"is_active": True, "updated_at": datetime.utcnow()}}
         )
     elif action_data.action == "reject" or action_data.action == "suspend":
-        await database.products.update_one(
+        previous = await database.products.find_one_and_update(
             {"id": product_id},
             {"$set": {"is_active": False, "updated_at": datetime.utcnow()}}
         )
     elif action_data.action == "delete":
-        await database.products.delete_one({"id": product_id})
+        previous = await database.products.find_one_and_delete({"id": product_id})
+    
+    active_delta = 0
+    if previous:
+        was_active = previous.get("is_active", False)
+        is_active = action_data.action == "approve"
+        active_delta = int(is_active) - int(was_active)
+    
+    # Keep the seller's denormalized active product count in step
+    if active_delta:
+        await database.users.update_one(
+            {"id": product["seller_id"]},
+            {"$inc": {"activeProductCount": active_delta}}
+        )
     
     # Log activity
     await log_admin_activity(
@@ -725,6 +752,16 @@ async def get_verification_stats(admin = Depends(get_current_admin)):
         "stats": stats
     }
 
+@router.get("/chat/connections", response_model=dict)
+async def get_chat_connection_metrics(admin = Depends(get_current_admin)):
+    """Get WebSocket connection telemetry for the worker serving this request"""
+    await check_admin_permission("view_analytics", admin)
+    
+    return {
+        "success": True,
+        "metrics": chat_service.connection_manager.get_connection_metrics()
+    }
+
 @router.get("/verifications/{verification_id}", response_model=dict)
 async def get_verification_details(
     verification_id: str,
@@ -813,8 +850,13 @@ async def review_verification(
         # Update user's verification status
         await database.users.update_one(
             {"id": verification["user_id"]},
-            {"$set": {"isVerified": True, "updatedAt": datetime.utcnow()}}
+            {
+                "$set": {"isVerified": True, "updatedAt": datetime.utcnow()},
+                "$inc": {"tokenVersion": 1}
+            }
         )
+        revoke_account_tokens("user", verification["user_id"])
+        seller_directory_cache.clear()
         
         message = f"Seller verification approved at {verification_level} level"
         
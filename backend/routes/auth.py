@@ -1,29 +1,30 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from passlib.hash import bcrypt
 from datetime import datetime, timedelta
+from typing import Optional
 import uuid
 import secrets
 import os
-from models.user import UserCreate, UserLogin, UserResponse
+from pymongo.errors import DuplicateKeyError
+from models.user import UserCreate, UserLogin, UserResponse, RefreshTokenRequest
 from models.password_reset import ForgotPasswordRequest, ResetPasswordRequest, PasswordResetToken, PasswordResetResponse
 from database import get_database
-from server import create_access_token, get_current_user
+from server import create_access_token, get_current_user, get_current_claims, build_token_claims, revoke_account_tokens
+from services.auth_service import (
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_tokens,
+    revoke_access_token, hash_token
+)
+from services.rate_limiter import rate_limiter
 
 router = APIRouter()
 
 @router.post("/register", response_model=dict)
-async def register_user(user_data: UserCreate):
+async def register_user(user_data: UserCreate, http_request: Request):
     """Register a new user (buyer or seller)"""
     
-    database = get_database()
+    await rate_limiter.check("register", http_request)
     
-    # Check if user already exists
-    existing_user = await database.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
+    database = get_database()
     
     # Hash password
     password_hash = bcrypt.hash(user_data.password)
@@ -39,15 +40,23 @@ async def register_user(user_data: UserCreate):
         "location": user_data.location,
         "phone": user_data.phone,
         "isVerified": False,
+        "tokenVersion": 0,
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow()
     }
     
-    # Insert user into database
-    await database.users.insert_one(user_doc)
+    # Insert user into database; the unique email index rejects duplicates
+    try:
+        await database.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     
     # Create access token
-    access_token = create_access_token(data={"sub": user_doc["id"]})
+    access_token = create_access_token(data=build_token_claims(user_doc))
+    refresh_token = await issue_refresh_token(database, user_doc["id"])
     
     # Return response (excluding password_hash)
     user_response = UserResponse(
@@ -66,13 +75,16 @@ async def register_user(user_data: UserCreate):
         "success": True,
         "message": "User registered successfully",
         "user": user_response.dict(),
-        "token": access_token
+        "token": access_token,
+        "refresh_token": refresh_token
     }
 
 @router.post("/login", response_model=dict)
-async def login_user(login_data: UserLogin):
+async def login_user(login_data: UserLogin, http_request: Request):
     """Login user and return access token"""
     
+    await rate_limiter.check("login", http_request, email=login_data.email)
+    
     database = get_database()
     
     # Find user by email
@@ -91,7 +103,8 @@ async def login_user(login_data: UserLogin):
         )
     
     # Create access token
-    access_token = create_access_token(data={"sub": user["id"]})
+    access_token = create_access_token(data=build_token_claims(user))
+    refresh_token = await issue_refresh_token(database, user["id"])
     
     # Return response (excluding password_hash)
     user_response = UserResponse(
@@ -110,7 +123,66 @@ async def login_user(login_data: UserLogin):
         "success": True,
         "message": "Login successful",
         "user": user_response.dict(),
-        "token": access_token
+        "token": access_token,
+        "refresh_token": refresh_token
+    }
+
+@router.post("/refresh", response_model=dict)
+async def refresh_access_token(request: RefreshTokenRequest):
+    """Exchange a refresh token for a new access token and refresh token"""
+    
+    database = get_database()
+    
+    token_doc = await rotate_refresh_token(database, request.refresh_token)
+    if not token_doc:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
+    
+    # Reload the account so the new token carries current claims
+    account = token_doc["account"]
+    if account == "admin":
+        account_doc = await database.admins.find_one({"id": token_doc["user_id"], "isActive": True})
+    else:
+        account_doc = await database.users.find_one({"id": token_doc["user_id"], "isActive": {"$ne": False}})
+    
+    if not account_doc:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
+    
+    access_token = create_access_token(data=build_token_claims(account_doc, account))
+    refresh_token = await issue_refresh_token(database, account_doc["id"], account, token_doc["family_id"])
+    
+    return {
+        "success": True,
+        "token": access_token,
+        "refresh_token": refresh_token
+    }
+
+@router.post("/logout", response_model=dict)
+async def logout_user(
+    request: Optional[RefreshTokenRequest] = None,
+    claims: dict = Depends(get_current_claims)
+):
+    """Revoke the current access token and, if given, its refresh token"""
+    
+    database = get_database()
+    
+    if claims.get("jti") and claims.get("exp"):
+        await revoke_access_token(database, claims["jti"], datetime.utcfromtimestamp(claims["exp"]))
+    
+    if request:
+        await database.refresh_tokens.update_one(
+            {"token_hash": hash_token(request.refresh_token), "user_id": claims["sub"]},
+            {"$set": {"revoked": True, "revoked_at": datetime.utcnow()}}
+        )
+    
+    return {
+        "success": True,
+        "message": "Logged out successfully"
     }
 
 @router.get("/me", response_model=dict)
@@ -145,13 +217,15 @@ async def get_current_user_info(current_user_id: str = Depends(get_current_user)
     }
 
 @router.post("/forgot-password", response_model=PasswordResetResponse)
-async def forgot_password(request: ForgotPasswordRequest):
+async def forgot_password(request: ForgotPasswordRequest, http_request: Request):
     """Request password reset - sends reset token via email (simulated)"""
     
+    await rate_limiter.check("forgot_password", http_request, email=request.email)
+    
     database = get_database()
     
     # Find user by email
-    user = await database.users.find_one({"email": request.email})
+    user = await database.users.find_one({"email": request.email}, {"id": 1, "email": 1})
     if not user:
         # Don't reveal if email exists or not for security
         return PasswordResetResponse(
@@ -164,21 +238,19 @@ async def forgot_password(request: ForgotPasswordRequest):
     reset_token = secrets.token_urlsafe(32)
     expires_at = datetime.utcnow() + timedelta(minutes=30)  # Token expires in 30 minutes
     
-    # Invalidate any existing reset tokens for this user
-    await database.password_reset_tokens.delete_many({"user_id": user["id"]})
-    
-    # Create new reset token
+    # Create new reset token, replacing any existing one for this user
     token_doc = {
         "id": str(uuid.uuid4()),
         "user_id": user["id"],
         "email": user["email"],
-        "token": reset_token,
+        "token_hash": hash_token(reset_token),
         "expires_at": expires_at,
-        "used": False,
         "created_at": datetime.utcnow()
     }
     
-    await database.password_reset_tokens.insert_one(token_doc)
+    await database.password_reset_tokens.replace_one(
+        {"user_id": user["id"]}, token_doc, upsert=True
+    )
     
     # In a real application, you would send an email here
     # For now, we'll log the reset link for development/testing
@@ -194,16 +266,15 @@ async def forgot_password(request: ForgotPasswordRequest):
     )
 
 @router.get("/verify-reset-token/{token}")
-async def verify_reset_token(token: str):
+async def verify_reset_token(token: str, http_request: Request):
     """Verify if a reset token is valid and not expired"""
     
+    await rate_limiter.check("reset_password", http_request)
+    
     database = get_database()
     
-    # Find the reset token
-    reset_token_doc = await database.password_reset_tokens.find_one({
-        "token": token,
-        "used": False
-    })
+    # Find the reset token by its hash
+    reset_token_doc = await database.password_reset_tokens.find_one({"token_hash": hash_token(token)})
     
     if not reset_token_doc:
         raise HTTPException(
@@ -211,34 +282,26 @@ async def verify_reset_token(token: str):
             detail="Invalid or expired reset token"
         )
     
-    # Check if token is expired
+    # Check if token is expired (the TTL index purges it shortly after)
     if datetime.utcnow() > reset_token_doc["expires_at"]:
-        # Mark token as expired by deleting it
-        await database.password_reset_tokens.delete_one({"id": reset_token_doc["id"]})
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Reset token has expired. Please request a new password reset."
         )
     
-    # Get user information
-    user = await database.users.find_one({"id": reset_token_doc["user_id"]})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User associated with this token no longer exists"
-        )
-    
     return {
         "success": True,
         "message": "Reset token is valid",
-        "email": user["email"],
+        "email": reset_token_doc["email"],
         "expires_at": reset_token_doc["expires_at"].isoformat()
     }
 
 @router.post("/reset-password", response_model=PasswordResetResponse)
-async def reset_password(request: ResetPasswordRequest):
+async def reset_password(request: ResetPasswordRequest, http_request: Request):
     """Reset password using valid reset token"""
     
+    await rate_limiter.check("reset_password", http_request)
+    
     database = get_database()
     
     # Validate passwords match
@@ -255,10 +318,9 @@ async def reset_password(request: ResetPasswordRequest):
             detail="Password must be at least 6 characters long"
         )
     
-    # Find and verify the reset token
-    reset_token_doc = await database.password_reset_tokens.find_one({
-        "token": request.token,
-        "used": False
+    # Consume the reset token atomically so it can only be used once
+    reset_token_doc = await database.password_reset_tokens.find_one_and_delete({
+        "token_hash": hash_token(request.token)
     })
     
     if not reset_token_doc:
@@ -269,41 +331,36 @@ async def reset_password(request: ResetPasswordRequest):
     
     # Check if token is expired
     if datetime.utcnow() > reset_token_doc["expires_at"]:
-        await database.password_reset_tokens.delete_one({"id": reset_token_doc["id"]})
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Reset token has expired. Please request a new password reset."
         )
     
-    # Find the user
-    user = await database.users.find_one({"id": reset_token_doc["user_id"]})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User associated with this token no longer exists"
-        )
-    
     # Hash the new password
     new_password_hash = bcrypt.hash(request.new_password)
     
-    # Update user's password
-    await database.users.update_one(
-        {"id": user["id"]},
+    # Update user's password and revoke tokens issued with the old one
+    user_id = reset_token_doc["user_id"]
+    result = await database.users.update_one(
+        {"id": user_id},
         {
             "$set": {
                 "password_hash": new_password_hash,
                 "updatedAt": datetime.utcnow()
-            }
+            },
+            "$inc": {"tokenVersion": 1}
         }
     )
+    if result.matched_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User associated with this token no longer exists"
+        )
     
-    # Mark the reset token as used and delete it
-    await database.password_reset_tokens.delete_one({"id": reset_token_doc["id"]})
-    
-    # Also delete any other unused tokens for this user
-    await database.password_reset_tokens.delete_many({"user_id": user["id"]})
+    revoke_account_tokens("user", user_id)
+    await revoke_refresh_tokens(database, user_id)
     
-    print(f"🔐 Password successfully reset for user: {user['email']}")
+    print(f"🔐 Password successfully reset for user: {reset_token_doc['email']}")
     
     return PasswordResetResponse(
         success=True,
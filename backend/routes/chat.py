@@ -1,18 +1,53 @@
-from fastapi import APIRouter, HTTPException, status, Depends, WebSocket, WebSocketDisconnect, Query
+from fastapi import APIRouter, HTTPException, status, Depends, WebSocket, WebSocketDisconnect, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
 from typing import List, Optional
 from datetime import datetime
 import uuid
-import json
+import asyncio
 from models.chat import (
     ChatCreate, MessageCreate, Chat, ChatMessage, ChatListResponse, 
-    ChatMessagesResponse, ReportChat, MessageType, ChatStatus, WSMessage, WSMessageType
+    ChatMessagesResponse, ChatSearchResponse, ReportChat, MessageType, ChatStatus, WSMessage, WSMessageType
 )
-from services.chat_service import chat_service
+from services.chat_service import chat_service, negotiate_protocol, decode_client_frame, is_allowed_media_type
+from services.blob_storage import BlobTooLargeError, is_blob_id, parse_range
+from services.rate_limiter import rate_limiter
 from database import get_database
-from server import get_current_user
+from server import get_current_user, get_current_claims
 
 router = APIRouter()
 
+# WebSocket clients must authenticate before anything is sent to them
+WS_AUTH_TIMEOUT_SECONDS = 10
+UNAUTHORIZED_CLOSE_CODE = 4401
+
+async def authenticate_websocket(websocket: WebSocket, user_id: str) -> bool:
+    """Check the socket's bearer token belongs to user_id.
+    
+    The token is read from the ``token`` query parameter or, since browsers
+    cannot set headers on a WebSocket, from a first ``auth`` frame.
+    """
+    token = websocket.query_params.get("token")
+    if not token:
+        try:
+            frame = await asyncio.wait_for(websocket.receive(), WS_AUTH_TIMEOUT_SECONDS)
+            if frame["type"] == "websocket.disconnect":
+                return False
+            auth_frame = decode_client_frame(frame)
+        except Exception:
+            return False
+        if auth_frame.get("type") != "auth":
+            return False
+        token = auth_frame.get("token")
+    if not token:
+        return False
+    
+    try:
+        claims = await get_current_claims(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        return False
+    return claims.get("sub") == user_id and claims.get("account", "user") == "user"
+
 @router.post("/create", response_model=dict)
 async def create_chat(
     chat_data: ChatCreate,
@@ -91,36 +126,14 @@ async def get_user_chats(
         # Calculate pagination
         skip = (page - 1) * limit
         
-        # Find chats where user is a participant
-        chats_cursor = database.chats.find(
-            {"participants.user_id": current_user_id, "status": {"$ne": "deleted"}},
-            sort=[("updated_at", -1)]
-        ).skip(skip).limit(limit)
-        
-        chats = []
-        total_unread = 0
-        
-        async for chat_doc in chats_cursor:
-            chat = Chat(**chat_doc)
-            
-            # Decrypt last message if it exists
-            if chat.last_message and chat.last_message.content.text:
-                chat.last_message.content.text = chat_service.encryption.decrypt_message(
-                    chat.last_message.content.text
-                )
-            
-            # Update participant online status
-            for participant in chat.participants:
-                participant.is_online = chat_service.connection_manager.is_user_online(participant.user_id)
-            
-            chats.append(chat)
-            total_unread += chat.unread_count.get(current_user_id, 0)
+        chats, total_count, total_unread = await chat_service.get_chat_summaries(
+            database, current_user_id, skip, limit
+        )
         
-        # Get total count
-        total_count = await database.chats.count_documents({
-            "participants.user_id": current_user_id,
-            "status": {"$ne": "deleted"}
-        })
+        # Update participant online status
+        for chat in chats:
+            for participant in chat["participants"]:
+                participant["is_online"] = chat_service.connection_manager.is_user_online(participant["user_id"])
         
         return ChatListResponse(
             chats=chats,
@@ -138,10 +151,17 @@ async def get_user_chats(
 async def get_chat_messages(
     chat_id: str,
     current_user_id: str = Depends(get_current_user),
-    page: int = Query(1, ge=1),
+    before: Optional[str] = Query(None, description="Return messages older than this message id"),
+    after: Optional[str] = Query(None, description="Return messages newer than this message id"),
     limit: int = Query(50, ge=1, le=100)
 ):
-    """Get messages for a specific chat"""
+    """Get messages for a specific chat, paged by message id cursors"""
+    
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before or after, not both"
+        )
     
     try:
         database = get_database()
@@ -160,28 +180,19 @@ async def get_chat_messages(
         
         chat = Chat(**chat_doc)
         
-        # Calculate pagination
-        skip = (page - 1) * limit
-        
         # Get messages
-        messages_cursor = database.chat_messages.find(
-            {"chat_id": chat_id},
-            sort=[("timestamp", -1)]
-        ).skip(skip).limit(limit)
-        
-        messages = []
-        async for message_doc in messages_cursor:
-            message = ChatMessage(**message_doc)
-            messages.append(message)
-        
-        # Reverse to get chronological order (oldest first)
-        messages.reverse()
+        try:
+            messages, has_more = await chat_service.get_messages_page(
+                database, chat_id, limit, before=before, after=after
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
         
         # Decrypt messages
-        decrypted_messages = chat_service.decrypt_messages(messages)
-        
-        # Get total message count
-        total_count = await database.chat_messages.count_documents({"chat_id": chat_id})
+        decrypted_messages = await chat_service.decrypt_messages(messages)
         
         # Mark messages as read
         await chat_service.mark_messages_read(database, current_user_id, chat_id)
@@ -189,8 +200,7 @@ async def get_chat_messages(
         return ChatMessagesResponse(
             messages=decrypted_messages,
             chat_info=chat,
-            has_more=skip + len(messages) < total_count,
-            total_count=total_count
+            has_more=has_more
         )
     
     except HTTPException:
@@ -201,6 +211,49 @@ async def get_chat_messages(
             detail=f"Failed to get messages: {str(e)}"
         )
 
+@router.get("/{chat_id}/search", response_model=ChatSearchResponse)
+async def search_chat_messages(
+    chat_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    before: Optional[str] = Query(None, description="Return matches older than this message id"),
+    limit: int = Query(20, ge=1, le=50),
+    current_user_id: str = Depends(get_current_user)
+):
+    """Search the messages of a chat by whole words, newest page first"""
+    
+    database = get_database()
+    
+    # Verify user is participant in chat
+    members = await chat_service.get_chat_members(database, chat_id)
+    if not members or current_user_id not in members:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found or access denied"
+        )
+    
+    search_tokens = chat_service.search_index.tokens(chat_id, q)
+    if not search_tokens:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query must contain a word of at least two characters"
+        )
+    
+    # Only matching messages are read and decrypted
+    try:
+        messages, has_more = await chat_service.get_messages_page(
+            database, chat_id, limit, before=before, search_tokens=search_tokens
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return ChatSearchResponse(
+        messages=await chat_service.decrypt_messages(messages),
+        has_more=has_more
+    )
+
 @router.post("/send-message", response_model=dict)
 async def send_message(
     message_data: MessageCreate,
@@ -212,12 +265,9 @@ async def send_message(
         database = get_database()
         
         # Verify user is participant in chat
-        chat_doc = await database.chats.find_one({
-            "id": message_data.chat_id,
-            "participants.user_id": current_user_id
-        })
+        members = await chat_service.get_chat_members(database, message_data.chat_id)
         
-        if not chat_doc:
+        if not members or current_user_id not in members:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Chat not found or access denied"
@@ -344,21 +394,142 @@ async def report_chat(
             detail=f"Failed to report chat: {str(e)}"
         )
 
+@router.post("/media", response_model=dict)
+async def upload_chat_media(
+    request: Request,
+    filename: Optional[str] = Query(None, max_length=255),
+    current_user_id: str = Depends(get_current_user)
+):
+    """Stream a chat attachment into storage; the body is the raw file"""
+    
+    await rate_limiter.check("chat_media_upload", request, user_id=current_user_id)
+    
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    if not is_allowed_media_type(content_type):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported attachment type"
+        )
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > chat_service.media.max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Attachment is too large"
+        )
+    
+    try:
+        media = await chat_service.store_media(
+            get_database(), request.stream(), content_type, filename, current_user_id
+        )
+    except BlobTooLargeError:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Attachment is too large"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return {
+        "success": True,
+        "media": media
+    }
+
+@router.get("/media/{media_id}")
+async def download_chat_media(
+    media_id: str,
+    request: Request,
+    expires: int = Query(...),
+    signature: str = Query(...)
+):
+    """Serve a chat attachment from a signed link, honouring Range requests"""
+    
+    if not is_blob_id(media_id) or not chat_service.media.verify_signature(media_id, expires, signature):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired media link"
+        )
+    
+    media = await chat_service.get_media(get_database(), media_id)
+    size = chat_service.media.size(media_id)
+    if media is None or size is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Media not found"
+        )
+    
+    # Blobs are content-addressed, so the id is a strong validator
+    etag = f'"{media_id}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={chat_service.media.url_ttl_seconds}, immutable",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"}
+            )
+    
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return StreamingResponse(
+        chat_service.media.iter_range(media_id, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=media["content_type"],
+        headers=headers
+    )
+
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     """WebSocket endpoint for real-time chat"""
     
-    await chat_service.connection_manager.connect(websocket, user_id)
+    protocol = negotiate_protocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=protocol)
+    if not await authenticate_websocket(websocket, user_id):
+        await websocket.close(code=UNAUTHORIZED_CLOSE_CODE)
+        return
+    
+    database = get_database()
+    contacts = await chat_service.load_chat_contacts(database, user_id)
+    connection = await chat_service.connection_manager.connect(websocket, user_id, contacts, protocol)
+    
+    # Catch up on anything missed while offline before live delivery
+    try:
+        await chat_service.sync_missed_messages(database, connection)
+    except Exception as e:
+        print(f"Offline sync failed for user {user_id}: {e}")
     
     try:
         while True:
             # Wait for messages from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            connection.touch()
+            message_data = decode_client_frame(frame)
             
             message_type = message_data.get("type")
             
-            if message_type == "typing":
+            if message_type == "pong":
+                # Heartbeat reply; touch() already recorded the activity
+                continue
+            
+            elif message_type == "typing":
                 # Handle typing indicator
                 chat_id = message_data.get("chat_id")
                 is_typing = message_data.get("is_typing", False)
@@ -369,24 +540,25 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             elif message_type == "subscribe_chat":
                 # Subscribe to chat updates
                 chat_id = message_data.get("chat_id")
-                await chat_service.connection_manager.subscribe_to_chat(user_id, chat_id)
+                await chat_service.connection_manager.subscribe_to_chat(connection, chat_id)
             
             elif message_type == "unsubscribe_chat":
                 # Unsubscribe from chat updates
                 chat_id = message_data.get("chat_id")
-                await chat_service.connection_manager.unsubscribe_from_chat(user_id, chat_id)
+                await chat_service.connection_manager.unsubscribe_from_chat(connection, chat_id)
     
     except WebSocketDisconnect:
-        chat_service.connection_manager.disconnect(user_id)
+        chat_service.connection_manager.disconnect(connection)
     except Exception as e:
         print(f"WebSocket error for user {user_id}: {e}")
-        chat_service.connection_manager.disconnect(user_id)
+        chat_service.connection_manager.disconnect(connection, reason="error")
 
 @router.get("/online-users", response_model=dict)
 async def get_online_users(current_user_id: str = Depends(get_current_user)):
-    """Get list of online users"""
+    """Get list of online users the current user shares a chat with"""
     
-    online_users = chat_service.connection_manager.get_online_users()
+    contacts = await chat_service.load_chat_contacts(get_database(), current_user_id)
+    online_users = chat_service.connection_manager.get_online_users(contacts)
     
     return {
         "success": True,
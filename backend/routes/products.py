@@ -5,27 +5,37 @@ import uuid
 import base64
 from models.product import ProductCreate, ProductUpdate, ProductResponse
 from database import get_database
-from server import get_current_user
+from server import get_current_claims
 
 router = APIRouter()
 
 @router.post("/", response_model=dict)
 async def create_product(
     product_data: ProductCreate,
-    current_user_id: str = Depends(get_current_user)
+    claims: dict = Depends(get_current_claims)
 ):
     """Create a new product (sellers only)"""
     
-    database = get_database()
-    
     # Verify user is a seller
-    user = await database.users.find_one({"id": current_user_id})
-    if not user or user["userType"] != "seller":
+    if claims.get("role") != "seller":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only sellers can create products"
         )
     
+    database = get_database()
+    current_user_id = claims["sub"]
+    
+    # Seller name is denormalized onto the product
+    user = await database.users.find_one(
+        {"id": current_user_id}, {"firstName": 1, "lastName": 1}
+    )
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
     # Create product document
     product_doc = {
         "id": str(uuid.uuid4()),
@@ -50,6 +60,12 @@ async def create_product(
     # Insert product into database
     await database.products.insert_one(product_doc)
     
+    # Denormalized counter served by the seller directory
+    await database.users.update_one(
+        {"id": current_user_id},
+        {"$inc": {"activeProductCount": 1}}
+    )
+    
     # Return response
     product_response = ProductResponse(
         id=product_doc["id"],
@@ -201,22 +217,22 @@ async def get_product(product_id: str):
 
 @router.get("/seller/my-products", response_model=dict)
 async def get_seller_products(
-    current_user_id: str = Depends(get_current_user),
+    claims: dict = Depends(get_current_claims),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=50)
 ):
     """Get products for the current seller"""
     
-    database = get_database()
-    
     # Verify user is a seller
-    user = await database.users.find_one({"id": current_user_id})
-    if not user or user["userType"] != "seller":
+    if claims.get("role") != "seller":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only sellers can access this endpoint"
         )
     
+    database = get_database()
+    current_user_id = claims["sub"]
+    
     # Calculate skip
     skip = (page - 1) * limit
     
@@ -267,15 +283,12 @@ async def get_seller_products(
 @router.post("/upload-media", response_model=dict)
 async def upload_media(
     files: List[UploadFile] = File(...),
-    current_user_id: str = Depends(get_current_user)
+    claims: dict = Depends(get_current_claims)
 ):
     """Upload images and video for products"""
     
-    database = get_database()
-    
     # Verify user is a seller
-    user = await database.users.find_one({"id": current_user_id})
-    if not user or user["userType"] != "seller":
+    if claims.get("role") != "seller":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only sellers can upload media"
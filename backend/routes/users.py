@@ -1,9 +1,17 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import List, Optional
 from datetime import datetime
-from models.user import UserResponse
+import re
+from models.user import UserResponse, SellerDirectoryEntry
 from database import get_database
 from server import get_current_user
+from services.cache import seller_directory_cache
+
+# Public fields of the seller directory
+SELLER_DIRECTORY_PROJECTION = {
+    "_id": 0, "id": 1, "firstName": 1, "lastName": 1,
+    "location": 1, "isVerified": 1, "activeProductCount": 1, "createdAt": 1
+}
 
 router = APIRouter()
 
@@ -86,33 +94,51 @@ async def update_user_profile(
     }
 
 @router.get("/sellers", response_model=dict)
-async def get_sellers():
-    """Get list of verified sellers"""
+async def get_sellers(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    location: Optional[str] = Query(None)
+):
+    """Get paginated directory of verified sellers"""
+    
+    cache_key = (page, limit, location.lower() if location else None)
+    cached = seller_directory_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
     database = get_database()
     
+    query = {"userType": "seller", "isVerified": True}
+    if location:
+        query["location"] = {"$regex": re.escape(location), "$options": "i"}
+    
+    # Calculate skip
+    skip = (page - 1) * limit
+    
     sellers_cursor = database.users.find(
-        {"userType": "seller", "isVerified": True},
-        {"password_hash": 0}  # Exclude password hash
-    )
+        query, SELLER_DIRECTORY_PROJECTION
+    ).sort([("createdAt", -1)]).skip(skip).limit(limit)
     
     sellers = []
     async for seller in sellers_cursor:
-        seller_response = UserResponse(
-            id=seller["id"],
-            firstName=seller["firstName"],
-            lastName=seller["lastName"],
-            email=seller["email"],
-            userType=seller["userType"],
-            location=seller["location"],
-            phone=seller.get("phone"),
-            isVerified=seller["isVerified"],
-            createdAt=seller["createdAt"]
-        )
-        sellers.append(seller_response.dict())
+        sellers.append(SellerDirectoryEntry(**seller).dict())
     
-    return {
+    # Get total count
+    total_count = await database.users.count_documents(query)
+    total_pages = (total_count + limit - 1) // limit
+    
+    response = {
         "success": True,
         "sellers": sellers,
-        "count": len(sellers)
-    }
\ No newline at end of file
+        "count": len(sellers),
+        "pagination": {
+            "currentPage": page,
+            "totalPages": total_pages,
+            "totalCount": total_count,
+            "hasNextPage": page < total_pages,
+            "hasPrevPage": page > 1
+        }
+    }
+    
+    seller_directory_cache.set(cache_key, response)
+    return response
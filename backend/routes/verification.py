@@ -10,28 +10,23 @@ from models.verification import (
     VerificationStats, VerifiedUserResponse, LIBERIAN_COUNTIES, VERIFICATION_REQUIREMENTS
 )
 from database import get_database
-from server import get_current_user
+from server import get_current_claims
 
 router = APIRouter()
 
-async def get_current_seller(current_user_id: str = Depends(get_current_user)):
+async def get_current_seller(claims: dict = Depends(get_current_claims)):
     """Ensure current user is a seller"""
-    database = get_database()
-    user = await database.users.find_one({"id": current_user_id})
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    if user["userType"] != "seller":
+    if claims.get("role") != "seller":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only sellers can access verification features"
         )
     
-    return user
+    return {
+        "id": claims["sub"],
+        "userType": claims["role"],
+        "isVerified": claims.get("isVerified", False)
+    }
 
 # Seller Verification Profile Management
 @router.post("/profile", response_model=dict)
@@ -3,11 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from contextlib import asynccontextmanager
 import os
+import uuid
+import asyncio
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 import uvicorn
-from database import connect_to_mongo, close_mongo_connection, get_database, is_database_connected
+from database import connect_to_mongo, close_mongo_connection, create_indexes, get_database, is_database_connected
+from services.auth_service import token_versions, token_version_key, token_decode_cache, revocation_filter
+from services.chat_service import chat_service
 
 # Load environment variables
 load_dotenv()
@@ -15,7 +19,7 @@ load_dotenv()
 # JWT configuration
 JWT_SECRET = os.getenv("JWT_SECRET", "your_super_secure_jwt_secret_key_here_2025")
 JWT_ALGORITHM = "HS256"
-JWT_EXPIRE_HOURS = 24
+JWT_ACCESS_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_EXPIRE_MINUTES", 15))
 
 security = HTTPBearer()
 
@@ -23,11 +27,21 @@ security = HTTPBearer()
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting Liberia2USA Express API...")
+    try:
+        chat_service.load_keys()
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ Chat keys are misconfigured: {e}")
+        raise
     await connect_to_mongo()
+    await create_indexes()
+    revocation_sync_task = asyncio.create_task(revocation_filter.run_periodic_sync(get_database))
+    await chat_service.start(get_database)
     print("✅ Application startup completed")
     yield
     # Shutdown
     print("🔄 Shutting down Liberia2USA Express API...")
+    revocation_sync_task.cancel()
+    await chat_service.stop()
     await close_mongo_connection()
     print("✅ Application shutdown completed")
 
@@ -51,29 +65,119 @@ app.add_middleware(
 # Utility functions
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(hours=JWT_EXPIRE_HOURS)
-    to_encode.update({"exp": expire})
+    expire = datetime.utcnow() + timedelta(minutes=JWT_ACCESS_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user_id
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+def build_token_claims(account_doc: dict, account: str = "user") -> dict:
+    """Build the signed authorization claims for a user or admin document"""
+    claims = {
+        "sub": account_doc["id"],
+        "account": account,
+        "ver": account_doc.get("tokenVersion", 0)
+    }
+    
+    if account == "admin":
+        claims.update({
+            "role": account_doc["role"],
+            "permissions": account_doc.get("permissions", []),
+            "isVerified": True,
+            "email": account_doc["email"],
+            "firstName": account_doc["firstName"],
+            "lastName": account_doc["lastName"]
+        })
+    else:
+        claims.update({
+            "role": account_doc["userType"],
+            "permissions": [],
+            "isVerified": account_doc.get("isVerified", False)
+        })
+    
+    return claims
+
+def credentials_exception(detail: str = "Could not validate credentials"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def account_collection(database, account: str):
+    """Return the collection holding accounts of the given kind"""
+    return database.admins if account == "admin" else database.users
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Decode the bearer token and return its authorization claims.
+    
+    The database is only read when the cached token version for the account
+    is missing or expired, or when the token predates embedded claims.
+    """
+    token = credentials.credentials
+    payload = token_decode_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            raise credentials_exception()
+        token_decode_cache.set(token, payload)
+    
+    user_id: str = payload.get("sub")
+    if user_id is None:
+        raise credentials_exception()
+    
+    account = payload.get("account", "user")
+    database = get_database()
+    if database is None:
+        return payload
+    
+    jti = payload.get("jti")
+    if jti and revocation_filter.might_be_revoked(jti):
+        if await database.revoked_tokens.find_one({"jti": jti}, {"_id": 1}):
+            raise credentials_exception("Token has been revoked")
+    
+    if "ver" not in payload:
+        # Legacy token without embedded claims - hydrate from the database
+        account_doc = await database.users.find_one({"id": user_id})
+        if not account_doc:
+            account_doc = await database.admins.find_one({"id": user_id, "isActive": True})
+            account = "admin"
+        if not account_doc:
+            raise credentials_exception()
+        token_versions.set(token_version_key(account, user_id), account_doc.get("tokenVersion", 0))
+        return build_token_claims(account_doc, account)
+    
+    version_key = token_version_key(account, user_id)
+    current_version = token_versions.get(version_key)
+    if current_version is not None and payload["ver"] > current_version:
+        # Token was issued after our cached read, so the cache is stale
+        current_version = payload["ver"]
+        token_versions.set(version_key, current_version)
+    elif current_version is None:
+        # Deactivated admins lose access once their cached version expires
+        query = {"id": user_id, "isActive": True} if account == "admin" else {"id": user_id}
+        account_doc = await account_collection(database, account).find_one(query, {"tokenVersion": 1})
+        if not account_doc:
+            raise credentials_exception()
+        current_version = account_doc.get("tokenVersion", 0)
+        token_versions.set(version_key, current_version)
+    
+    if payload["ver"] < current_version:
+        raise credentials_exception("Token has been revoked")
+    
+    return payload
+
+async def get_current_user(claims: dict = Depends(get_current_claims)):
+    return claims["sub"]
+
+def revoke_account_tokens(account: str, user_id: str):
+    """Drop the cached token version after ``tokenVersion`` was incremented.
+    
+    Callers increment ``tokenVersion`` in the same update that changes the
+    role, verification or active state, then call this so the next request
+    re-reads it.
+    """
+    token_versions.invalidate(token_version_key(account, user_id))
 
 # Health check endpoint - must not depend on database for Kubernetes health checks
 @app.get("/api/health")
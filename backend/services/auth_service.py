@@ -0,0 +1,244 @@
+import os
+import math
+import time
+import uuid
+import asyncio
+import hashlib
+import secrets
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Refresh token configuration
+JWT_REFRESH_EXPIRE_DAYS = int(os.getenv("JWT_REFRESH_EXPIRE_DAYS", 30))
+REVOCATION_SYNC_SECONDS = int(os.getenv("REVOCATION_SYNC_SECONDS", 30))
+
+
+def token_version_key(account: str, user_id: str) -> str:
+    """Build the cache key for an account's token version"""
+    return f"{account}:{user_id}"
+
+
+class TokenVersionCache:
+    """Process-local view of the current token version of each account.
+
+    Tokens carry the ``ver`` they were issued with. As long as the cached
+    version is fresh we can authorize purely from the token; the database is
+    only consulted once an entry is missing or older than ``ttl_seconds``.
+    """
+
+    def __init__(self, ttl_seconds: int = 60):
+        self.ttl_seconds = ttl_seconds
+        # key -> (version, cached_at)
+        self._versions: Dict[str, Tuple[int, float]] = {}
+
+    def get(self, key: str) -> Optional[int]:
+        """Return the cached version, or None when missing or stale"""
+        entry = self._versions.get(key)
+        if entry is None:
+            return None
+        version, cached_at = entry
+        if time.monotonic() - cached_at > self.ttl_seconds:
+            del self._versions[key]
+            return None
+        return version
+
+    def set(self, key: str, version: int):
+        """Record the latest known version for an account"""
+        self._versions[key] = (version, time.monotonic())
+
+    def invalidate(self, key: str):
+        """Forget the cached version so the next request re-reads it"""
+        self._versions.pop(key, None)
+
+
+class TokenDecodeCache:
+    """Bounded LRU of token digest -> verified JWT payload.
+
+    A page load sends the same bearer token many times; caching the verified
+    payload skips the HMAC check and JSON parse on repeat requests. Only
+    tokens that already passed ``jwt.decode`` are stored, and entries are
+    dropped once their ``exp`` claim has passed.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # digest -> (payload, exp timestamp)
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Return the cached payload for a token, or None"""
+        digest = self._digest(token)
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return payload
+
+    def set(self, token: str, payload: dict):
+        """Cache a verified payload until its expiry"""
+        expires_at = payload.get("exp")
+        if expires_at is None:
+            return
+        digest = self._digest(token)
+        self._entries[digest] = (payload, float(expires_at))
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """In-memory filter of revoked access token ids (``jti``).
+
+    The filter is rebuilt from ``revoked_tokens`` every
+    ``sync_interval_seconds`` so revocations made by other workers are picked
+    up and expired entries fall out. A negative answer is definitive, so valid
+    tokens never cost a database read; only positive hits are confirmed
+    against Mongo.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001,
+                 sync_interval_seconds: int = REVOCATION_SYNC_SECONDS):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval_seconds = sync_interval_seconds
+        self._filter = BloomFilter(capacity, error_rate)
+        # jtis revoked locally while a rebuild is in flight
+        self._pending: Optional[List[str]] = None
+
+    def add(self, jti: str):
+        self._filter.add(jti)
+        if self._pending is not None:
+            self._pending.append(jti)
+
+    def might_be_revoked(self, jti: str) -> bool:
+        return jti in self._filter
+
+    async def sync(self, database):
+        """Rebuild the filter from the revoked token collection"""
+        self._pending = []
+        try:
+            rebuilt = BloomFilter(self.capacity, self.error_rate)
+            async for doc in database.revoked_tokens.find({}, {"jti": 1}):
+                rebuilt.add(doc["jti"])
+            for jti in self._pending:
+                rebuilt.add(jti)
+            self._filter = rebuilt
+        finally:
+            self._pending = None
+
+    async def run_periodic_sync(self, get_database):
+        """Keep the filter synchronized until cancelled"""
+        while True:
+            database = get_database()
+            if database is not None:
+                try:
+                    await self.sync(database)
+                except Exception as e:
+                    print(f"⚠️ Revocation filter sync failed: {e}")
+            await asyncio.sleep(self.sync_interval_seconds)
+
+
+def hash_token(token: str) -> str:
+    """Refresh and reset tokens are stored only as their SHA-256 digest"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue_refresh_token(database, user_id: str, account: str = "user",
+                              family_id: Optional[str] = None) -> str:
+    """Create and persist a new opaque refresh token"""
+    refresh_token = secrets.token_urlsafe(48)
+    token_doc = {
+        "id": str(uuid.uuid4()),
+        "token_hash": hash_token(refresh_token),
+        "family_id": family_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "account": account,
+        "revoked": False,
+        "expires_at": datetime.utcnow() + timedelta(days=JWT_REFRESH_EXPIRE_DAYS),
+        "created_at": datetime.utcnow()
+    }
+    await database.refresh_tokens.insert_one(token_doc)
+    return refresh_token
+
+
+async def rotate_refresh_token(database, refresh_token: str) -> Optional[dict]:
+    """Consume a refresh token, returning its document if it was still valid.
+
+    Presenting an already rotated token means it leaked, so the whole token
+    family is revoked.
+    """
+    now = datetime.utcnow()
+    token_hash = hash_token(refresh_token)
+    token_doc = await database.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "revoked": False, "expires_at": {"$gt": now}},
+        {"$set": {"revoked": True, "revoked_at": now}}
+    )
+    if token_doc:
+        return token_doc
+    
+    reused = await database.refresh_tokens.find_one({"token_hash": token_hash, "revoked": True})
+    if reused:
+        await database.refresh_tokens.update_many(
+            {"family_id": reused["family_id"], "revoked": False},
+            {"$set": {"revoked": True, "revoked_at": now}}
+        )
+    return None
+
+
+async def revoke_refresh_tokens(database, user_id: str, account: str = "user"):
+    """Revoke every outstanding refresh token of an account"""
+    await database.refresh_tokens.update_many(
+        {"user_id": user_id, "account": account, "revoked": False},
+        {"$set": {"revoked": True, "revoked_at": datetime.utcnow()}}
+    )
+
+
+async def revoke_access_token(database, jti: str, expires_at: datetime):
+    """Revoke an access token until it would have expired anyway"""
+    await database.revoked_tokens.update_one(
+        {"jti": jti},
+        {"$setOnInsert": {"jti": jti, "expires_at": expires_at, "created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    revocation_filter.add(jti)
+
+
+# Global token caches
+token_versions = TokenVersionCache()
+token_decode_cache = TokenDecodeCache()
+revocation_filter = RevocationFilter()
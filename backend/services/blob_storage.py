@@ -0,0 +1,160 @@
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import tempfile
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+from PIL import Image
+
+# Chat media storage configuration
+CHAT_MEDIA_DIR = os.getenv(
+    "CHAT_MEDIA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media")
+)
+CHAT_MEDIA_MAX_BYTES = int(os.getenv("CHAT_MEDIA_MAX_BYTES", 100 * 1024 * 1024))
+CHAT_MEDIA_URL_TTL_SECONDS = int(os.getenv("CHAT_MEDIA_URL_TTL_SECONDS", 86400))
+CHAT_MEDIA_SIGNING_KEY = os.getenv("CHAT_MEDIA_SIGNING_KEY") or os.getenv(
+    "JWT_SECRET", "your_super_secure_jwt_secret_key_here_2025"
+)
+CHAT_MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class BlobTooLargeError(Exception):
+    pass
+
+
+def is_blob_id(blob_id: str) -> bool:
+    """Blob ids are lowercase hex SHA-256 digests"""
+    return len(blob_id) == 64 and all(c in "0123456789abcdef" for c in blob_id)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into an inclusive (start, end).
+
+    Returns None when the whole blob should be sent and raises ValueError
+    when the range cannot be satisfied. Multi-range requests are answered
+    with the whole blob, which RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise ValueError("Unsatisfiable range")
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError("Unsatisfiable range")
+    if start < 0 or start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+class BlobStorage:
+    """Content-addressed files on disk, named by the SHA-256 of their bytes.
+
+    Uploads are streamed to a temporary file while hashing and then renamed
+    into place, so identical attachments are stored once and a blob never
+    changes after it is written. Point ``CHAT_MEDIA_DIR`` at a shared volume
+    when running more than one node.
+    """
+
+    def __init__(self, root: str = CHAT_MEDIA_DIR, max_bytes: int = CHAT_MEDIA_MAX_BYTES,
+                 signing_key: str = CHAT_MEDIA_SIGNING_KEY,
+                 url_ttl_seconds: int = CHAT_MEDIA_URL_TTL_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.signing_key = signing_key.encode()
+        self.url_ttl_seconds = url_ttl_seconds
+
+    def path_for(self, blob_id: str) -> str:
+        if not is_blob_id(blob_id):
+            raise ValueError("Invalid blob id")
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        """Stream chunks into storage and return (blob id, size)"""
+        loop = asyncio.get_running_loop()
+        temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        temp = tempfile.NamedTemporaryFile(dir=temp_dir, delete=False)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise BlobTooLargeError(f"Attachment exceeds {self.max_bytes} bytes")
+                digest.update(chunk)
+                await loop.run_in_executor(None, temp.write, chunk)
+            await loop.run_in_executor(None, temp.close)
+
+            blob_id = digest.hexdigest()
+            path = self.path_for(blob_id)
+            if os.path.exists(path):
+                os.remove(temp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp.name, path)
+            return blob_id, size
+        except BaseException:
+            temp.close()
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+            raise
+
+    def delete(self, blob_id: str) -> bool:
+        """Remove a blob; returns False if it was already gone"""
+        try:
+            os.remove(self.path_for(blob_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def size(self, blob_id: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path_for(blob_id))
+        except (OSError, ValueError):
+            return None
+
+    def iter_range(self, blob_id: str, start: int, end: int) -> Iterator[bytes]:
+        """Yield the bytes from start to end inclusive, a chunk at a time"""
+        with open(self.path_for(blob_id), "rb") as blob:
+            blob.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = blob.read(min(CHAT_MEDIA_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def image_dimensions(self, blob_id: str) -> Tuple[Optional[int], Optional[int]]:
+        """Read image dimensions from the header without decoding pixels"""
+        try:
+            with Image.open(self.path_for(blob_id)) as image:
+                return image.width, image.height
+        except Exception:
+            return None, None
+
+    def _signature(self, blob_id: str, expires: int) -> str:
+        return hmac.new(self.signing_key, f"{blob_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+    def signed_url(self, blob_id: str) -> str:
+        """Build a download link that browsers can load without auth headers"""
+        # Expiry is rounded up so links stay stable, and cacheable, within a window
+        expires = (int(time.time()) // self.url_ttl_seconds + 2) * self.url_ttl_seconds
+        return f"/api/chat/media/{blob_id}?expires={expires}&signature={self._signature(blob_id, expires)}"
+
+    def verify_signature(self, blob_id: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(blob_id, expires), signature)
@@ -0,0 +1,251 @@
+import os
+import json
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+from urllib.parse import urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Message bus configuration
+CHAT_BUS_BACKEND = os.getenv("CHAT_BUS_BACKEND", "inprocess")
+CHAT_BUS_REDIS_URL = os.getenv("CHAT_BUS_REDIS_URL", "redis://localhost:6379/0")
+CHAT_BUS_CHANNEL = os.getenv("CHAT_BUS_CHANNEL", "chat_events")
+
+EnvelopeHandler = Callable[[dict], Awaitable[None]]
+
+
+def dumps_envelope(envelope: dict) -> bytes:
+    """Encode an envelope for the wire, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(envelope, default=str)
+    return json.dumps(envelope, default=str).encode()
+
+
+def loads_envelope(payload: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+class InProcessBus:
+    """Deliver envelopes to every subscriber in this process.
+
+    Enough for a single worker, and lets several ConnectionManagers in one
+    process behave like separate nodes.
+    """
+
+    def __init__(self):
+        self._handlers: List[EnvelopeHandler] = []
+
+    async def start(self, handler: EnvelopeHandler):
+        self._handlers.append(handler)
+
+    async def publish(self, envelope: dict):
+        for handler in list(self._handlers):
+            try:
+                await handler(envelope)
+            except Exception as e:
+                print(f"Chat bus handler error: {e}")
+
+    async def stop(self):
+        self._handlers.clear()
+
+
+class MongoChangeStreamBus:
+    """Fan envelopes out through inserts into a collection watched by every node.
+
+    Requires a replica set (change streams). Published documents are purged
+    by a TTL index on ``created_at``.
+    """
+
+    def __init__(self, get_database, collection_name: str = CHAT_BUS_CHANNEL):
+        self.get_database = get_database
+        self.collection_name = collection_name
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EnvelopeHandler):
+        self._task = asyncio.create_task(self._watch(handler))
+
+    async def _watch(self, handler: EnvelopeHandler):
+        retry_delay = 1
+        while True:
+            database = self.get_database()
+            if database is None:
+                await asyncio.sleep(retry_delay)
+                continue
+            try:
+                pipeline = [{"$match": {"operationType": "insert"}}]
+                async with database[self.collection_name].watch(pipeline) as stream:
+                    retry_delay = 1
+                    async for change in stream:
+                        try:
+                            await handler(change["fullDocument"]["envelope"])
+                        except Exception as e:
+                            print(f"Chat bus handler error: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Chat bus change stream failed: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+
+    async def publish(self, envelope: dict):
+        database = self.get_database()
+        if database is None:
+            return
+        await database[self.collection_name].insert_one({
+            "envelope": envelope,
+            "created_at": datetime.utcnow()
+        })
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class RedisProtocolError(Exception):
+    pass
+
+
+class RedisConnection:
+    """Minimal RESP client covering the commands the bus needs"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, url: str) -> "RedisConnection":
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        connection = cls(reader, writer)
+        if parsed.password:
+            if parsed.username:
+                await connection.command("AUTH", parsed.username, parsed.password)
+            else:
+                await connection.command("AUTH", parsed.password)
+        return connection
+
+    @staticmethod
+    def encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    async def send(self, *args):
+        self.writer.write(self.encode(*args))
+        await self.writer.drain()
+
+    async def read_reply(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisProtocolError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise RedisProtocolError(f"Unexpected reply: {line!r}")
+
+    async def command(self, *args):
+        await self.send(*args)
+        return await self.read_reply()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class RedisBus:
+    """Fan envelopes out over Redis PUBLISH/SUBSCRIBE.
+
+    Speaks RESP directly so it works against Redis or any server
+    implementing the pub/sub subset of the protocol.
+    """
+
+    def __init__(self, url: str = CHAT_BUS_REDIS_URL, channel: str = CHAT_BUS_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self._publisher: Optional[RedisConnection] = None
+        self._publish_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EnvelopeHandler):
+        self._task = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: EnvelopeHandler):
+        retry_delay = 1
+        while True:
+            subscriber = None
+            try:
+                subscriber = await RedisConnection.open(self.url)
+                await subscriber.send("SUBSCRIBE", self.channel)
+                retry_delay = 1
+                while True:
+                    reply = await subscriber.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        try:
+                            await handler(loads_envelope(reply[2]))
+                        except Exception as e:
+                            print(f"Chat bus handler error: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Chat bus subscriber failed: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            finally:
+                if subscriber is not None:
+                    await subscriber.close()
+
+    async def publish(self, envelope: dict):
+        payload = dumps_envelope(envelope)
+        async with self._publish_lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = await RedisConnection.open(self.url)
+                await self._publisher.command("PUBLISH", self.channel, payload)
+            except Exception as e:
+                print(f"⚠️ Chat bus publish failed: {e}")
+                if self._publisher is not None:
+                    await self._publisher.close()
+                self._publisher = None
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._publisher is not None:
+            await self._publisher.close()
+            self._publisher = None
+
+
+def create_chat_bus():
+    """Build the bus for the configured backend"""
+    if CHAT_BUS_BACKEND == "mongo":
+        from database import get_database
+        return MongoChangeStreamBus(get_database)
+    if CHAT_BUS_BACKEND == "redis":
+        return RedisBus()
+    return InProcessBus()
@@ -0,0 +1,68 @@
+import os
+import re
+import hmac
+import base64
+import hashlib
+import secrets
+import unicodedata
+from typing import List, Optional
+
+# Search index configuration
+CHAT_SEARCH_MIN_TOKEN_LENGTH = 2
+CHAT_SEARCH_MAX_TOKENS = 256
+CHAT_SEARCH_HASH_BYTES = 16
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_tokens(text: Optional[str]) -> List[str]:
+    """Split text into distinct case- and accent-insensitive word tokens"""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    tokens = []
+    seen = set()
+    for token in _TOKEN_PATTERN.findall(stripped):
+        if len(token) < CHAT_SEARCH_MIN_TOKEN_LENGTH or token in seen:
+            continue
+        seen.add(token)
+        tokens.append(token)
+        if len(tokens) >= CHAT_SEARCH_MAX_TOKENS:
+            break
+    return tokens
+
+
+class BlindIndex:
+    """Keyed hashes of message words, so encrypted chats can be searched.
+
+    Each token is hashed with HMAC-SHA256 under a server-side key and the
+    chat id, so the same word yields unrelated hashes in different chats and
+    the stored hashes reveal nothing without the key. Only whole words are
+    matched.
+    """
+
+    def __init__(self, key: Optional[bytes] = None):
+        self.key = key or self._load_key()
+
+    @staticmethod
+    def _load_key() -> bytes:
+        # Kept apart from the encryption keys, which rotate
+        key_env = os.getenv("CHAT_SEARCH_KEY")
+        if key_env:
+            return key_env.encode()
+        if os.getenv("CHAT_ALLOW_EPHEMERAL_KEYS", "false").lower() != "true":
+            raise RuntimeError(
+                "CHAT_SEARCH_KEY is not set. Generate one with "
+                "python -c 'import secrets; print(secrets.token_urlsafe(32))'"
+            )
+        print("⚠️ Using a temporary chat search key; the search index will not survive a restart")
+        return base64.urlsafe_b64encode(secrets.token_bytes(32))
+
+    def hash_token(self, chat_id: str, token: str) -> bytes:
+        message = f"{chat_id}\x00{token}".encode()
+        return hmac.new(self.key, message, hashlib.sha256).digest()[:CHAT_SEARCH_HASH_BYTES]
+
+    def tokens(self, chat_id: str, text: Optional[str]) -> List[bytes]:
+        """Hashes of the words in a message, or of the words a match must contain"""
+        return [self.hash_token(chat_id, token) for token in normalize_tokens(text)]
@@ -1,144 +1,772 @@
 import json
+import math
+import time
+import bisect
 import asyncio
-from typing import Dict, Set, List, Optional
-from datetime import datetime
+from collections import Counter, deque
+from enum import Enum
+from typing import Deque, Dict, Set, List, Optional, Tuple, Union
+from datetime import datetime, timedelta
 import uuid
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 import base64
 import os
 from fastapi import WebSocket
+from pydantic import BaseModel
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from models.chat import (
-    Chat, ChatMessage, ChatParticipant, MessageContent, MessageType, 
+    Chat, ChatMessage, ChatParticipant, MessageContent, StoredMessageContent, MessageType, 
     ChatStatus, MessageStatus, WSMessage, WSMessageType
 )
+from services.blob_storage import BlobStorage
+from services.chat_bus import InProcessBus, create_chat_bus
+from services.chat_search import BlindIndex
+from services.cache import TTLCache
+from services.typing_debouncer import TypingDebouncer
+from services.write_batcher import WriteBatcher
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Encryption key configuration
+CHAT_ALLOW_EPHEMERAL_KEYS = os.getenv("CHAT_ALLOW_EPHEMERAL_KEYS", "false").lower() == "true"
+CHAT_KEY_ROTATION_BATCH_SIZE = int(os.getenv("CHAT_KEY_ROTATION_BATCH_SIZE", 500))
+CHAT_KEY_ROTATION_PAUSE_SECONDS = float(os.getenv("CHAT_KEY_ROTATION_PAUSE_SECONDS", 1.0))
+DECRYPT_FAILURE_LOG_SECONDS = 60
+
+
+def parse_encryption_keys(current_key: Optional[str], current_version: int,
+                          retired_keys: Optional[str]) -> Dict[int, Fernet]:
+    """Build version -> cipher from the current key and "version:key" retired keys"""
+    keys = {}
+    for entry in filter(None, (retired_keys or "").split(",")):
+        version, _, key = entry.strip().partition(":")
+        keys[int(version)] = key
+    if current_key:
+        keys[current_version] = current_key
+    # Fernet rejects keys that are not 32 url-safe base64 bytes
+    return {
+        version: Fernet(base64.urlsafe_b64encode(base64.urlsafe_b64decode(key.encode())))
+        for version, key in keys.items()
+    }
+
 
 class ChatEncryption:
-    """Handle message encryption/decryption"""
+    """Handle message encryption/decryption with versioned keys.
     
-    def _generate_key(self) -> bytes:
-        """Generate a new encryption key"""
-        return Fernet.generate_key()
+    New ciphertext is written with the current key and stored next to its
+    key version, so decryption picks the right key directly. Retired keys
+    stay configured until the rotation job has re-encrypted everything;
+    only unversioned legacy ciphertext falls back to trying each key.
+    """
     
-    def __init__(self):
-        # In production, use a secure key management system
-        key_env = os.getenv('CHAT_ENCRYPTION_KEY')
-        if key_env:
+    def __init__(self, ciphers: Optional[Dict[int, Fernet]] = None, version: Optional[int] = None):
+        if ciphers is None:
+            version = int(os.getenv("CHAT_ENCRYPTION_KEY_VERSION", 1))
             try:
-                # Try to use the key from environment as base64
-                self.key = base64.urlsafe_b64decode(key_env.encode())
-                self.cipher = Fernet(base64.urlsafe_b64encode(self.key))
+                ciphers = parse_encryption_keys(
+                    os.getenv("CHAT_ENCRYPTION_KEY"), version, os.getenv("CHAT_ENCRYPTION_RETIRED_KEYS")
+                )
             except Exception:
-                # If invalid, generate new key
-                self.key = self._generate_key()
-                self.cipher = Fernet(self.key)
-        else:
-            # Generate new key
-            self.key = self._generate_key()
-            self.cipher = Fernet(self.key)
+                raise ValueError(
+                    "CHAT_ENCRYPTION_KEY or CHAT_ENCRYPTION_RETIRED_KEYS holds an invalid Fernet key; "
+                    "keys are 32 url-safe base64-encoded bytes, retired keys are written version:key"
+                )
+            if version not in ciphers:
+                if not CHAT_ALLOW_EPHEMERAL_KEYS:
+                    raise RuntimeError(
+                        "CHAT_ENCRYPTION_KEY is not set. Generate one with "
+                        "python -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())'"
+                    )
+                print("⚠️ Using a temporary chat encryption key; messages will not survive a restart")
+                ciphers[version] = Fernet(Fernet.generate_key())
+        
+        self.version = version
+        self.ciphers = ciphers
+        self.cipher = ciphers[version]
+        # Current key first, so MultiFernet.rotate() re-encrypts with it
+        self.multi_cipher = MultiFernet(
+            [self.cipher] + [cipher for v, cipher in sorted(ciphers.items(), reverse=True) if v != version]
+        )
+        self.decrypt_failures = 0
+        self._last_failure_log = -math.inf
+    
+    @property
+    def retired_versions(self) -> List[int]:
+        return sorted(v for v in self.ciphers if v != self.version)
     
-    def encrypt_message(self, message: str) -> str:
-        """Encrypt a message"""
+    def encrypt_message(self, message: str) -> Optional[bytes]:
+        """Encrypt a message with the current key to the raw bytes of a Fernet token"""
         try:
-            encrypted = self.cipher.encrypt(message.encode())
-            return base64.urlsafe_b64encode(encrypted).decode()
+            # Fernet tokens are base64 text; store the decoded bytes as BSON binary
+            return base64.urlsafe_b64decode(self.cipher.encrypt(message.encode()))
         except Exception as e:
             print(f"Encryption error: {e}")
-            return message  # Return original if encryption fails
+            return None
     
-    def decrypt_message(self, encrypted_message: str) -> str:
-        """Decrypt a message"""
+    def _cipher_for(self, key_version: Optional[int]):
+        if key_version is None:
+            return self.multi_cipher
+        cipher = self.ciphers.get(key_version)
+        if cipher is None:
+            raise InvalidToken(f"Key version {key_version} is not configured")
+        return cipher
+    
+    def decrypt_message(self, encrypted_message: Union[bytes, str], key_version: Optional[int] = None) -> str:
+        """Decrypt binary ciphertext, or a legacy base64 string"""
         try:
-            encrypted_bytes = base64.urlsafe_b64decode(encrypted_message.encode())
-            decrypted = self.cipher.decrypt(encrypted_bytes)
-            return decrypted.decode()
+            if isinstance(encrypted_message, str):
+                token = base64.urlsafe_b64decode(encrypted_message.encode())
+            else:
+                token = base64.urlsafe_b64encode(encrypted_message)
+            return self._cipher_for(key_version).decrypt(token).decode()
         except Exception as e:
-            print(f"Decryption error: {e}")
-            return encrypted_message  # Return original if decryption fails
+            self._record_failure(e)
+            # Return original if decryption fails
+            return encrypted_message if isinstance(encrypted_message, str) else ""
+    
+    def rotate(self, ciphertext: bytes, key_version: Optional[int] = None) -> bytes:
+        """Re-encrypt binary ciphertext with the current key; raises InvalidToken"""
+        token = base64.urlsafe_b64encode(ciphertext)
+        plaintext = self._cipher_for(key_version).decrypt(token)
+        return base64.urlsafe_b64decode(self.cipher.encrypt(plaintext))
+    
+    def _record_failure(self, error: Exception):
+        # Pages can hold hundreds of undecryptable messages; log a summary instead
+        self.decrypt_failures += 1
+        now = time.monotonic()
+        if now - self._last_failure_log >= DECRYPT_FAILURE_LOG_SECONDS:
+            self._last_failure_log = now
+            print(f"⚠️ Chat decryption failed ({self.decrypt_failures} failures so far): {error!r}")
+    
+    @staticmethod
+    def legacy_to_binary(encrypted_message: str) -> bytes:
+        """Convert legacy double-base64 ciphertext to binary without decrypting"""
+        token = base64.urlsafe_b64decode(base64.urlsafe_b64decode(encrypted_message.encode()))
+        # Fernet tokens start with version byte 0x80
+        if not token or token[0] != 0x80:
+            raise ValueError("Not a Fernet token")
+        return token
+
+# Chat list previews are truncated to this many characters
+CHAT_PREVIEW_LENGTH = 100
+
+# Attachment types accepted for upload; SVG is excluded as it can carry script
+CHAT_MEDIA_TYPE_PREFIXES = ("image/", "video/", "audio/", "application/pdf")
+CHAT_MEDIA_BLOCKED_TYPES = {"image/svg+xml"}
+
+
+# Uploads no message references are deleted once this old, by a sweep this often
+CHAT_MEDIA_ORPHAN_HOURS = float(os.getenv("CHAT_MEDIA_ORPHAN_HOURS", 24))
+CHAT_MEDIA_SWEEP_SECONDS = float(os.getenv("CHAT_MEDIA_SWEEP_SECONDS", 3600))
+
+
+def is_allowed_media_type(content_type: str) -> bool:
+    return content_type.startswith(CHAT_MEDIA_TYPE_PREFIXES) and content_type not in CHAT_MEDIA_BLOCKED_TYPES
+
+# Presence changes within this window are coalesced into one update
+PRESENCE_COALESCE_SECONDS = float(os.getenv("PRESENCE_COALESCE_SECONDS", 1.0))
+
+# Outbound queue configuration
+CHAT_OUTBOUND_QUEUE_SIZE = int(os.getenv("CHAT_OUTBOUND_QUEUE_SIZE", 256))
+# Event types dropped first when a client's queue is full
+CHAT_DROPPABLE_EVENTS = {
+    WSMessageType(event.strip())
+    for event in os.getenv("CHAT_DROPPABLE_EVENTS", "user_typing").split(",") if event.strip()
+}
+# What to do once nothing droppable is left: "disconnect" or "drop"
+CHAT_SLOW_CONSUMER_POLICY = os.getenv("CHAT_SLOW_CONSUMER_POLICY", "disconnect")
+# Close code sent to slow consumers (1013: try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Heartbeat configuration: ping every interval, reap sockets silent for the timeout
+CHAT_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("CHAT_HEARTBEAT_INTERVAL_SECONDS", 25))
+CHAT_IDLE_TIMEOUT_SECONDS = float(os.getenv("CHAT_IDLE_TIMEOUT_SECONDS", 60))
+# Application close code sent to reaped idle sockets
+IDLE_CLOSE_CODE = 4008
+
+# Offline sync: messages per frame, and the most streamed on one connect
+CHAT_SYNC_BATCH_SIZE = int(os.getenv("CHAT_SYNC_BATCH_SIZE", 100))
+CHAT_SYNC_MAX_MESSAGES = int(os.getenv("CHAT_SYNC_MAX_MESSAGES", 1000))
+# How often delivery cursors are persisted
+DELIVERY_CURSOR_FLUSH_SECONDS = float(os.getenv("DELIVERY_CURSOR_FLUSH_SECONDS", 5))
+
+# Upper bounds of the send latency histogram buckets, in milliseconds
+SEND_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of queue-to-socket send latency"""
+    
+    def __init__(self, buckets: Tuple[float, ...] = SEND_LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+    
+    def observe(self, latency_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, latency_ms)] += 1
+    
+    def to_dict(self) -> Dict[str, int]:
+        labels = [f"le_{bound}ms" for bound in self.buckets] + ["inf"]
+        return dict(zip(labels, self.counts))
+
+# WebSocket subprotocols; clients that ask for none get JSON text frames
+JSON_PROTOCOL = "chat.v1.json"
+MSGPACK_PROTOCOL = "chat.v1.msgpack"
+
+def negotiate_protocol(requested: List[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from the client's offer"""
+    if MSGPACK_PROTOCOL in requested and msgpack is not None:
+        return MSGPACK_PROTOCOL
+    if JSON_PROTOCOL in requested:
+        return JSON_PROTOCOL
+    return None
+
+def decode_client_frame(frame: dict) -> dict:
+    """Decode an inbound ASGI websocket.receive event of either protocol"""
+    if frame.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames are not supported")
+        return msgpack.unpackb(frame["bytes"])
+    return json.loads(frame["text"])
+
+def _msgpack_default(value):
+    # Timestamps travel as epoch milliseconds rather than ISO-8601 strings
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+def pack_message(message: WSMessage) -> bytes:
+    """Encode an event as MessagePack straight from its native values"""
+    event = {"type": message.type.value, "data": message.data, "timestamp": message.timestamp}
+    if message.sender_id is not None:
+        event["sender_id"] = message.sender_id
+    return msgpack.packb(event, default=_msgpack_default)
+
+class Frame:
+    """One WebSocket event, encoded at most once per wire protocol.
+    
+    JSON frames carry ISO-8601 timestamps. MessagePack frames are packed from
+    the event's native values, with timestamps as integer epoch milliseconds
+    and ``sender_id`` left out when unset. Events relayed from another node arrive
+    already encoded.
+    """
+    
+    __slots__ = ("message", "_text", "_packed")
+    
+    def __init__(self, message: Optional[WSMessage] = None, text: Optional[str] = None,
+                 packed: Optional[bytes] = None):
+        self.message = message
+        self._text = text
+        self._packed = packed
+    
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.message.model_dump_json()
+        return self._text
+    
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            if self.message is not None:
+                self._packed = pack_message(self.message)
+            else:
+                # Relayed by a node that did not send a packed frame
+                self._packed = msgpack.packb(json.loads(self._text))
+        return self._packed
+    
+    def encoded(self, protocol: Optional[str]) -> Union[str, bytes]:
+        if protocol == MSGPACK_PROTOCOL:
+            return self.packed
+        return self.text
+    
+    def to_envelope(self) -> dict:
+        """Both encodings, for relaying the event to other nodes"""
+        envelope = {"frame": self.text}
+        if msgpack is not None:
+            envelope["packed"] = base64.b64encode(self.packed).decode()
+        return envelope
+    
+    @classmethod
+    def from_envelope(cls, envelope: dict) -> "Frame":
+        packed = envelope.get("packed")
+        return cls(text=envelope["frame"], packed=base64.b64decode(packed) if packed else None)
+
+def encode_frame(message: WSMessage) -> Frame:
+    """Wrap a WebSocket event so every recipient shares its encodings"""
+    return Frame(message)
+
+# (chat_id, (timestamp, message_id)) pairs a frame delivers
+Deliveries = Tuple[Tuple[str, Tuple[datetime, str]], ...]
+
+
+class ClientConnection:
+    """A WebSocket with its own bounded outbound queue drained by a writer task"""
+    
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager",
+                 protocol: Optional[str] = None,
+                 max_queue_size: int = CHAT_OUTBOUND_QUEUE_SIZE,
+                 droppable_types: Set[WSMessageType] = CHAT_DROPPABLE_EVENTS,
+                 slow_consumer_policy: str = CHAT_SLOW_CONSUMER_POLICY):
+        self.connection_id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        self.protocol = protocol
+        self.max_queue_size = max_queue_size
+        self.droppable_types = droppable_types
+        self.slow_consumer_policy = slow_consumer_policy
+        # Queued encoded frames with their enqueue time and the chat positions they deliver
+        self.queue: Deque[Tuple[WSMessageType, Union[str, bytes], float, Deliveries]] = deque()
+        self.connected_at = datetime.now()
+        self.last_activity = time.monotonic()
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        # Metrics
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+        self.max_queue_depth = 0
+        self.send_latency = LatencyHistogram()
+    
+    def touch(self):
+        """Record inbound traffic from the client"""
+        self.last_activity = time.monotonic()
+    
+    def start(self):
+        """Start the writer task"""
+        self._writer_task = asyncio.create_task(self._writer())
+    
+    def enqueue(self, message_type: WSMessageType, frame: Frame, deliveries: Deliveries = ()) -> bool:
+        """Queue a frame without blocking, applying the overflow policy.
+        
+        ``deliveries`` are (chat_id, position) pairs recorded on the user's
+        delivery cursors only once the frame has actually been written.
+        """
+        if self.closed:
+            return False
+        
+        if len(self.queue) >= self.max_queue_size:
+            if message_type in self.droppable_types:
+                self.frames_dropped += 1
+                return False
+            if not self._drop_queued_droppable():
+                if self.slow_consumer_policy == "disconnect":
+                    print(f"Disconnecting slow consumer {self.user_id}: outbound queue full")
+                    self.manager.disconnect(self, close_code=SLOW_CONSUMER_CLOSE_CODE, reason="slow_consumer")
+                else:
+                    self.frames_dropped += 1
+                return False
+        
+        self.queue.append((message_type, frame.encoded(self.protocol), time.monotonic(), deliveries))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        self._ready.set()
+        return True
+    
+    def _drop_queued_droppable(self) -> bool:
+        """Evict the oldest queued droppable frame to make room"""
+        for index, (message_type, _, _, _) in enumerate(self.queue):
+            if message_type in self.droppable_types:
+                del self.queue[index]
+                self.frames_dropped += 1
+                return True
+        return False
+    
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                _, payload, enqueued_at, deliveries = self.queue.popleft()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                    self.bytes_sent += len(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                    self.bytes_sent += len(payload.encode())
+                # Frames still queued or lost mid-send are resent by the next sync
+                for chat_id, position in deliveries:
+                    self.manager.record_delivery(self.user_id, chat_id, position)
+                latency_ms = (time.monotonic() - enqueued_at) * 1000
+                self.send_latency.observe(latency_ms)
+                self.manager.send_latency.observe(latency_ms)
+                self.frames_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending message to {self.user_id}: {e}")
+            # Remove broken connection
+            self.manager.disconnect(self, reason="send_error")
+    
+    def close(self, close_code: Optional[int] = None):
+        """Stop the writer and optionally close the socket"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        if close_code is not None:
+            asyncio.create_task(self._close_socket(close_code))
+    
+    async def _close_socket(self, close_code: int):
+        try:
+            await self.websocket.close(code=close_code)
+        except Exception:
+            pass
+    
+    def metrics(self) -> dict:
+        return {
+            "connection_id": self.connection_id,
+            "user_id": self.user_id,
+            "protocol": self.protocol or JSON_PROTOCOL,
+            "connected_at": self.connected_at,
+            "queue_depth": len(self.queue),
+            "idle_seconds": round(time.monotonic() - self.last_activity, 1),
+            "max_queue_depth": self.max_queue_depth,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_dropped": self.frames_dropped,
+            "send_latency_ms": self.send_latency.to_dict()
+        }
 
 class ConnectionManager:
     """Manage WebSocket connections for real-time chat"""
     
-    def __init__(self):
-        # Store active connections: user_id -> WebSocket
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, presence_window: float = PRESENCE_COALESCE_SECONDS, bus=None):
+        # Identifies this worker on the message bus
+        self.node_id = uuid.uuid4().hex
+        self.bus = bus if bus is not None else InProcessBus()
+        # Store active connections: connection_id -> ClientConnection
+        self.connections: Dict[str, ClientConnection] = {}
+        # Sessions of each online user (tabs, devices): user_id -> set of connection_ids
+        self.user_connections: Dict[str, Set[str]] = {}
         # Store user presence: user_id -> last_seen
         self.user_presence: Dict[str, datetime] = {}
-        # Store chat subscriptions: user_id -> set of chat_ids
+        # Store chat subscriptions: connection_id -> set of chat_ids
         self.chat_subscriptions: Dict[str, Set[str]] = {}
+        # Reverse index for fan-out: chat_id -> set of subscribed connection_ids
+        self.chat_subscribers: Dict[str, Set[str]] = {}
+        # Users sharing a chat with each online user: user_id -> set of user_ids
+        self.contacts: Dict[str, Set[str]] = {}
+        
+        # Presence changes waiting for the next flush: user_id -> (is_online, contacts)
+        self.presence_window = presence_window
+        self._pending_presence: Dict[str, Tuple[bool, Set[str]]] = {}
+        self._announced_online: Set[str] = set()
+        self._presence_flush_task: Optional[asyncio.Task] = None
+        # Users online on other nodes: user_id -> set of node_ids
+        self.remote_presence: Dict[str, Set[str]] = {}
+        # Typing frames are debounced before they are fanned out
+        self.typing = TypingDebouncer(self._send_typing_indicator)
+        
+        # Heartbeat and telemetry
+        self.heartbeat_interval = CHAT_HEARTBEAT_INTERVAL_SECONDS
+        self.idle_timeout = CHAT_IDLE_TIMEOUT_SECONDS
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.send_latency = LatencyHistogram()
+        self.disconnect_reasons: Counter = Counter()
+        
+        # Delivery positions not yet persisted: (user_id, chat_id) -> (timestamp, message_id)
+        self.delivered: Dict[Tuple[str, str], Tuple[datetime, str]] = {}
+    
+    async def start(self):
+        """Start receiving events published by other nodes and the heartbeat"""
+        await self.bus.start(self._handle_bus_envelope)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+    
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        self.typing.stop()
+        await self.bus.stop()
+    
+    async def _heartbeat(self):
+        """Ping every connection and reap the ones that stopped answering"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.reap_idle_connections()
     
-    async def connect(self, websocket: WebSocket, user_id: str):
-        """Accept WebSocket connection and register user"""
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    def reap_idle_connections(self):
+        now = time.monotonic()
+        ping = encode_frame(WSMessage(type=WSMessageType.PING, data={}))
+        for connection in list(self.connections.values()):
+            if now - connection.last_activity > self.idle_timeout:
+                self.disconnect(connection, close_code=IDLE_CLOSE_CODE, reason="idle_timeout")
+            else:
+                connection.enqueue(WSMessageType.PING, ping)
+    
+    async def _handle_bus_envelope(self, envelope: dict):
+        """Deliver an event published by another node to local connections"""
+        if envelope.get("origin") == self.node_id:
+            return
+        
+        kind = envelope.get("kind")
+        if kind == "chat":
+            position = envelope.get("position")
+            if position is not None:
+                position = (datetime.fromisoformat(position[0]), position[1])
+            self._deliver_to_chat(
+                envelope["chat_id"], WSMessageType(envelope["message_type"]),
+                Frame.from_envelope(envelope), envelope.get("exclude_user"), position
+            )
+        elif kind == "user":
+            self._deliver_to_user(
+                envelope["user_id"], WSMessageType(envelope["message_type"]), Frame.from_envelope(envelope)
+            )
+        elif kind == "presence":
+            self._deliver_presence(envelope["changes"], remote_origin=envelope["origin"])
+        elif kind == "contacts":
+            self._add_local_contacts(envelope["user_id"], envelope["other_user_id"])
+    
+    async def connect(self, websocket: WebSocket, user_id: str, contacts: Optional[Set[str]] = None,
+                      protocol: Optional[str] = None) -> ClientConnection:
+        """Register an accepted, authenticated WebSocket as one of the user's sessions"""
+        connection = ClientConnection(websocket, user_id, self, protocol=protocol)
+        connection.start()
+        self.connections[connection.connection_id] = connection
+        self.chat_subscriptions[connection.connection_id] = set()
+        sessions = self.user_connections.setdefault(user_id, set())
+        sessions.add(connection.connection_id)
         self.user_presence[user_id] = datetime.now()
-        self.chat_subscriptions[user_id] = set()
+        self.contacts.setdefault(user_id, set()).update(contacts or ())
         
-        # Notify others that user is online
-        await self.broadcast_user_status(user_id, True)
+        # Notify chat partners once the user's first session comes online
+        if len(sessions) == 1:
+            self.queue_presence_change(user_id, True)
+        else:
+            self._send_presence_snapshot(connection)
+        return connection
     
-    def disconnect(self, user_id: str):
-        """Remove user connection"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    def _send_presence_snapshot(self, connection: ClientConnection):
+        """Tell an extra session which of the user's chat partners are online"""
+        users = [
+            {"user_id": contact_id, "is_online": True}
+            for contact_id in self.contacts.get(connection.user_id, ())
+            if self.is_user_online(contact_id)
+        ]
+        if users:
+            message = WSMessage(type=WSMessageType.PRESENCE_UPDATE, data={"users": users})
+            connection.enqueue(message.type, encode_frame(message))
+    
+    def disconnect(self, connection: ClientConnection, close_code: Optional[int] = None,
+                   reason: str = "client_closed"):
+        """Remove a session; the user goes offline with their last one"""
+        connection.close(close_code)
+        if self.connections.pop(connection.connection_id, None) is None:
+            return
         
-        if user_id in self.user_presence:
-            self.user_presence[user_id] = datetime.now()
+        self.disconnect_reasons[reason] += 1
+        user_id = connection.user_id
+        self._clear_subscriptions(connection.connection_id)
+        self.user_presence[user_id] = datetime.now()
         
-        if user_id in self.chat_subscriptions:
-            del self.chat_subscriptions[user_id]
+        sessions = self.user_connections.get(user_id, set())
+        sessions.discard(connection.connection_id)
+        if sessions:
+            return
+        self.user_connections.pop(user_id, None)
         
-        # Notify others that user is offline
-        asyncio.create_task(self.broadcast_user_status(user_id, False))
+        # Notify chat partners that user is offline
+        self.queue_presence_change(user_id, False)
+        self.contacts.pop(user_id, None)
     
-    async def subscribe_to_chat(self, user_id: str, chat_id: str):
-        """Subscribe user to chat updates"""
-        if user_id not in self.chat_subscriptions:
-            self.chat_subscriptions[user_id] = set()
-        self.chat_subscriptions[user_id].add(chat_id)
+    def _clear_subscriptions(self, connection_id: str):
+        """Drop all of a session's subscriptions from both indexes"""
+        for chat_id in self.chat_subscriptions.pop(connection_id, set()):
+            self._remove_subscriber(chat_id, connection_id)
     
-    async def unsubscribe_from_chat(self, user_id: str, chat_id: str):
-        """Unsubscribe user from chat updates"""
-        if user_id in self.chat_subscriptions:
-            self.chat_subscriptions[user_id].discard(chat_id)
+    def _remove_subscriber(self, chat_id: str, connection_id: str):
+        subscribers = self.chat_subscribers.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(connection_id)
+            if not subscribers:
+                del self.chat_subscribers[chat_id]
     
-    async def send_to_user(self, user_id: str, message: WSMessage):
-        """Send message to specific user"""
-        if user_id in self.active_connections:
-            try:
-                websocket = self.active_connections[user_id]
-                await websocket.send_text(message.json())
-                return True
-            except Exception as e:
-                print(f"Error sending message to {user_id}: {e}")
-                # Remove broken connection
-                self.disconnect(user_id)
-                return False
-        return False
+    async def subscribe_to_chat(self, connection: ClientConnection, chat_id: str):
+        """Subscribe a session to chat updates"""
+        subscriptions = self.chat_subscriptions.get(connection.connection_id)
+        if subscriptions is None:
+            return
+        subscriptions.add(chat_id)
+        self.chat_subscribers.setdefault(chat_id, set()).add(connection.connection_id)
     
-    async def send_to_chat(self, chat_id: str, message: WSMessage, exclude_user: Optional[str] = None):
-        """Send message to all users subscribed to a chat"""
+    async def unsubscribe_from_chat(self, connection: ClientConnection, chat_id: str):
+        """Unsubscribe a session from chat updates"""
+        subscriptions = self.chat_subscriptions.get(connection.connection_id)
+        if subscriptions is not None:
+            subscriptions.discard(chat_id)
+        self._remove_subscriber(chat_id, connection.connection_id)
+    
+    def _deliver_to_user(self, user_id: str, message_type: WSMessageType, frame: Frame) -> bool:
+        delivered = False
+        # Copy: a slow consumer is disconnected mid-loop and mutates the index
+        for connection_id in list(self.user_connections.get(user_id, ())):
+            connection = self.connections.get(connection_id)
+            if connection is not None and connection.enqueue(message_type, frame):
+                delivered = True
+        return delivered
+    
+    def _deliver_to_chat(self, chat_id: str, message_type: WSMessageType, frame: Frame,
+                         exclude_user: Optional[str] = None,
+                         position: Optional[Tuple[datetime, str]] = None) -> int:
         sent_count = 0
-        for user_id, subscriptions in self.chat_subscriptions.items():
-            if chat_id in subscriptions and user_id != exclude_user:
-                if await self.send_to_user(user_id, message):
-                    sent_count += 1
+        for connection_id in list(self.chat_subscribers.get(chat_id, ())):
+            connection = self.connections.get(connection_id)
+            if connection is None or connection.user_id == exclude_user:
+                continue
+            deliveries = ((chat_id, position),) if position is not None else ()
+            if connection.enqueue(message_type, frame, deliveries):
+                sent_count += 1
         return sent_count
     
-    async def broadcast_user_status(self, user_id: str, is_online: bool):
-        """Broadcast user online/offline status"""
-        message = WSMessage(
-            type=WSMessageType.USER_ONLINE if is_online else WSMessageType.USER_OFFLINE,
-            data={"user_id": user_id, "is_online": is_online},
-            sender_id=user_id
-        )
+    def record_delivery(self, user_id: str, chat_id: str, position: Tuple[datetime, str]):
+        """Advance a user's delivery cursor for a chat"""
+        key = (user_id, chat_id)
+        current = self.delivered.get(key)
+        if current is None or position > current:
+            self.delivered[key] = position
+    
+    def pop_delivered(self) -> Dict[Tuple[str, str], Tuple[datetime, str]]:
+        """Take the delivery positions recorded since the last flush"""
+        delivered, self.delivered = self.delivered, {}
+        return delivered
+    
+    async def send_to_user(self, user_id: str, message: WSMessage):
+        """Queue message for every session of a user on every node"""
+        frame = encode_frame(message)
+        delivered = self._deliver_to_user(user_id, message.type, frame)
+        await self.bus.publish({
+            "kind": "user",
+            "origin": self.node_id,
+            "user_id": user_id,
+            "message_type": message.type.value,
+            **frame.to_envelope()
+        })
+        return delivered
+    
+    async def send_to_chat(self, chat_id: str, message: WSMessage, exclude_user: Optional[str] = None,
+                           position: Optional[Tuple[datetime, str]] = None):
+        """Send message to all users subscribed to a chat on any node.
+        
+        A position (timestamp, message_id) advances the delivery cursor of
+        every user reached. Returns the number of local sessions reached.
+        """
+        frame = encode_frame(message)
+        sent_count = self._deliver_to_chat(chat_id, message.type, frame, exclude_user, position)
+        await self.bus.publish({
+            "kind": "chat",
+            "origin": self.node_id,
+            "chat_id": chat_id,
+            "exclude_user": exclude_user,
+            "message_type": message.type.value,
+            **frame.to_envelope(),
+            "position": [position[0].isoformat(), position[1]] if position else None
+        })
+        return sent_count
+    
+    def _add_local_contacts(self, user_id: str, other_user_id: str):
+        if user_id in self.contacts:
+            self.contacts[user_id].add(other_user_id)
+        if other_user_id in self.contacts:
+            self.contacts[other_user_id].add(user_id)
+    
+    async def add_contacts(self, user_id: str, other_user_id: str):
+        """Record on every node that two users now share a chat"""
+        self._add_local_contacts(user_id, other_user_id)
+        await self.bus.publish({
+            "kind": "contacts",
+            "origin": self.node_id,
+            "user_id": user_id,
+            "other_user_id": other_user_id
+        })
+    
+    def queue_presence_change(self, user_id: str, is_online: bool):
+        """Queue a presence change for the next coalesced flush"""
+        self._pending_presence[user_id] = (is_online, set(self.contacts.get(user_id, ())))
+        if self._presence_flush_task is None or self._presence_flush_task.done():
+            self._presence_flush_task = asyncio.create_task(self._flush_presence_later())
+    
+    async def _flush_presence_later(self):
+        await asyncio.sleep(self.presence_window)
+        await self.flush_presence()
+    
+    async def flush_presence(self):
+        """Deliver pending presence changes, one frame per recipient.
+        
+        Only users sharing a chat with the subject are told, and a flap that
+        ends in the state last announced is dropped entirely.
+        """
+        pending, self._pending_presence = self._pending_presence, {}
+        changes = []
+        
+        for user_id, (is_online, contacts) in pending.items():
+            if is_online == (user_id in self._announced_online):
+                continue
+            if is_online:
+                self._announced_online.add(user_id)
+            else:
+                self._announced_online.discard(user_id)
+            changes.append({"user_id": user_id, "is_online": is_online, "contacts": list(contacts)})
+        
+        if not changes:
+            return
         
-        # Send to all connected users
-        for connected_user_id in self.active_connections:
-            if connected_user_id != user_id:
-                await self.send_to_user(connected_user_id, message)
+        self._deliver_presence(changes)
+        await self.bus.publish({"kind": "presence", "origin": self.node_id, "changes": changes})
+    
+    def _deliver_presence(self, changes: List[dict], remote_origin: Optional[str] = None):
+        """Send local chat partners one frame each covering all presence changes"""
+        updates: Dict[str, List[dict]] = {}
+        
+        for change in changes:
+            user_id = change["user_id"]
+            if remote_origin is not None:
+                nodes = self.remote_presence.setdefault(user_id, set())
+                if change["is_online"]:
+                    nodes.add(remote_origin)
+                else:
+                    nodes.discard(remote_origin)
+                    if not nodes:
+                        del self.remote_presence[user_id]
+            
+            # The user may still be online through another node
+            is_online = self.is_user_online(user_id)
+            
+            if remote_origin is None and change["is_online"]:
+                # A newly online user also learns which partners are online
+                for contact_id in change["contacts"]:
+                    if self.is_user_online(contact_id):
+                        updates.setdefault(user_id, []).append(
+                            {"user_id": contact_id, "is_online": True}
+                        )
+            
+            for contact_id in change["contacts"]:
+                if contact_id in self.user_connections:
+                    updates.setdefault(contact_id, []).append(
+                        {"user_id": user_id, "is_online": is_online}
+                    )
+        
+        for recipient_id, users in updates.items():
+            message = WSMessage(
+                type=WSMessageType.PRESENCE_UPDATE,
+                data={"users": users}
+            )
+            self._deliver_to_user(recipient_id, message.type, encode_frame(message))
     
     async def handle_typing_indicator(self, user_id: str, chat_id: str, is_typing: bool):
         """Handle typing indicators"""
+        await self.typing.update(user_id, chat_id, is_typing)
+    
+    async def _send_typing_indicator(self, user_id: str, chat_id: str, is_typing: bool):
         message = WSMessage(
             type=WSMessageType.USER_TYPING,
             data={
@@ -152,37 +780,326 @@ class ConnectionManager:
         await self.send_to_chat(chat_id, message, exclude_user=user_id)
     
     def is_user_online(self, user_id: str) -> bool:
-        """Check if user is currently online"""
-        return user_id in self.active_connections
+        """Check if user is currently online on this or another node"""
+        return user_id in self.user_connections or user_id in self.remote_presence
+    
+    def get_connection_metrics(self) -> dict:
+        """Connection telemetry for this worker"""
+        return {
+            "node_id": self.node_id,
+            "open_connections": len(self.connections),
+            "online_users": len(self.user_connections),
+            "send_latency_ms": self.send_latency.to_dict(),
+            "disconnect_reasons": dict(self.disconnect_reasons),
+            "connections": [connection.metrics() for connection in self.connections.values()]
+        }
     
-    def get_online_users(self) -> List[str]:
-        """Get list of online user IDs"""
-        return list(self.active_connections.keys())
+    def get_online_users(self, user_ids: Optional[Set[str]] = None) -> List[str]:
+        """Get list of online user IDs, optionally limited to the given users"""
+        if user_ids is None:
+            return list(set(self.user_connections) | set(self.remote_presence))
+        return [user_id for user_id in user_ids if self.is_user_online(user_id)]
+
+def chat_pair_key(user_a: str, user_b: str, product_id: Optional[str] = None) -> str:
+    """Canonical key of the one chat two users may have about a product"""
+    first, second = sorted((user_a, user_b))
+    return f"{first}:{second}:{product_id or ''}"
+
 
 class ChatService:
     """Main chat service for handling chat operations"""
     
     def __init__(self):
-        self.encryption = ChatEncryption()
-        self.connection_manager = ConnectionManager()
+        # Keys are read on first use, so importing the service never fails on configuration
+        self._encryption: Optional[ChatEncryption] = None
+        self._search_index: Optional[BlindIndex] = None
+        self.connection_manager = ConnectionManager(bus=create_chat_bus())
+        # Participants never change after creation: chat_id -> {user_id: user_name}
+        self.chat_members = TTLCache(max_size=10000, ttl_seconds=600)
+        self._get_database = None
+        self._cursor_flush_task: Optional[asyncio.Task] = None
+        self._key_rotation_task: Optional[asyncio.Task] = None
+        self._media_sweep_task: Optional[asyncio.Task] = None
+        # Message inserts and chat summary updates are group-committed
+        self.writes = WriteBatcher()
+        # Attachments live outside Mongo; messages only reference them
+        self.media = BlobStorage()
+        # Messages are immutable, so decrypted previews are cached by message id
+        self.preview_cache = TTLCache(max_size=10000, ttl_seconds=3600)
+    
+    @property
+    def encryption(self) -> ChatEncryption:
+        if self._encryption is None:
+            self._encryption = ChatEncryption()
+        return self._encryption
+    
+    @encryption.setter
+    def encryption(self, encryption: ChatEncryption):
+        self._encryption = encryption
+    
+    @property
+    def search_index(self) -> BlindIndex:
+        if self._search_index is None:
+            self._search_index = BlindIndex()
+        return self._search_index
+    
+    @search_index.setter
+    def search_index(self, search_index: BlindIndex):
+        self._search_index = search_index
+    
+    def load_keys(self):
+        """Read the encryption and search keys; raises RuntimeError or ValueError if misconfigured"""
+        if self._encryption is None:
+            self._encryption = ChatEncryption()
+        if self._search_index is None:
+            self._search_index = BlindIndex()
+    
+    async def start(self, get_database=None):
+        self.load_keys()
+        await self.connection_manager.start()
+        self._get_database = get_database
+        if get_database is not None:
+            self._cursor_flush_task = asyncio.create_task(self._flush_delivery_cursors_periodically())
+            self._media_sweep_task = asyncio.create_task(self._sweep_orphaned_media_periodically())
+            if self.encryption.retired_versions:
+                self._key_rotation_task = asyncio.create_task(self._rotate_keys_in_background())
+    
+    async def stop(self):
+        if self._key_rotation_task is not None:
+            self._key_rotation_task.cancel()
+        if self._media_sweep_task is not None:
+            self._media_sweep_task.cancel()
+        if self._cursor_flush_task is not None:
+            self._cursor_flush_task.cancel()
+            await self._flush_delivery_cursors()
+        await self.connection_manager.stop()
+    
+    async def _rotate_keys_in_background(self):
+        database = self._get_database()
+        while database is None:
+            await asyncio.sleep(5)
+            database = self._get_database()
+        try:
+            rotated = await self.rotate_encryption_keys(database)
+            print(f"✅ Re-encrypted {rotated} chat messages with key version {self.encryption.version}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Chat key rotation failed: {e}")
+    
+    async def rotate_encryption_keys(self, database, batch_size: int = CHAT_KEY_ROTATION_BATCH_SIZE,
+                                     pause_seconds: float = CHAT_KEY_ROTATION_PAUSE_SECONDS) -> int:
+        """Re-encrypt ciphertext written with retired keys, in throttled bulk batches.
+        
+        Messages and chat previews are walked in _id order. Each update only
+        applies if the ciphertext is still the one that was read, so the job
+        can run on several nodes at once and simply resumes after a restart.
+        """
+        rotated = 0
+        loop = asyncio.get_running_loop()
+        for collection, field in ((database.chat_messages, "content"), (database.chats, "last_message.content")):
+            query = {
+                f"{field}.ciphertext": {"$type": "binData"},
+                f"{field}.key_version": {"$ne": self.encryption.version}
+            }
+            projection = {"_id": 1, f"{field}.ciphertext": 1, f"{field}.key_version": 1}
+            last_id = None
+            while True:
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                docs = await collection.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+                if not docs:
+                    break
+                last_id = docs[-1]["_id"]
+                
+                updates = await loop.run_in_executor(None, self._rotation_updates, docs, field)
+                if updates:
+                    await collection.bulk_write(updates, ordered=False)
+                    rotated += len(updates)
+                await asyncio.sleep(pause_seconds)
+        return rotated
+    
+    def _rotation_updates(self, docs: List[dict], field: str) -> List[UpdateOne]:
+        updates = []
+        for doc in docs:
+            content = doc
+            for part in field.split("."):
+                content = content[part]
+            try:
+                ciphertext = self.encryption.rotate(content["ciphertext"], content.get("key_version"))
+            except InvalidToken:
+                # Written with a key that is no longer configured; nothing to recover
+                continue
+            updates.append(UpdateOne(
+                {"_id": doc["_id"], f"{field}.ciphertext": content["ciphertext"]},
+                {"$set": {f"{field}.ciphertext": ciphertext, f"{field}.key_version": self.encryption.version}}
+            ))
+        return updates
+    
+    async def _sweep_orphaned_media_periodically(self):
+        while True:
+            await asyncio.sleep(CHAT_MEDIA_SWEEP_SECONDS)
+            database = self._get_database()
+            if database is None:
+                continue
+            try:
+                deleted = await self.delete_orphaned_media(database)
+                if deleted:
+                    print(f"🧹 Deleted {deleted} unreferenced chat attachments")
+            except Exception as e:
+                print(f"⚠️ Chat media sweep failed: {e}")
+    
+    async def delete_orphaned_media(self, database, max_age_hours: float = CHAT_MEDIA_ORPHAN_HOURS) -> int:
+        """Delete uploads that no message references once they are old enough.
+        
+        The age is counted from the latest upload of the same bytes, so a
+        re-uploaded blob gets a fresh grace period to be sent in a message.
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+        stale = {"created_at": {"$lt": cutoff}, "last_uploaded_at": {"$not": {"$gte": cutoff}}}
+        deleted = 0
+        async for media in database.chat_media.find(stale, {"_id": 0, "id": 1}):
+            media_id = media["id"]
+            if await database.chat_messages.find_one({"content.media_id": media_id}, {"_id": 1}):
+                continue
+            # Only delete if no upload refreshed the document since it was read
+            result = await database.chat_media.delete_one({"id": media_id, **stale})
+            if result.deleted_count:
+                self.media.delete(media_id)
+                deleted += 1
+        return deleted
+    
+    async def _flush_delivery_cursors_periodically(self):
+        while True:
+            await asyncio.sleep(DELIVERY_CURSOR_FLUSH_SECONDS)
+            await self._flush_delivery_cursors()
+    
+    async def _flush_delivery_cursors(self):
+        database = self._get_database() if self._get_database else None
+        if database is None:
+            return
+        try:
+            await self.flush_delivery_cursors(database)
+        except Exception as e:
+            print(f"⚠️ Delivery cursor flush failed: {e}")
+    
+    async def flush_delivery_cursors(self, database):
+        """Persist the delivery positions recorded since the last flush"""
+        delivered = self.connection_manager.pop_delivered()
+        if not delivered:
+            return
+        
+        # $max keeps the cursor from moving backwards; message_id only breaks
+        # timestamp ties, so a stale one at worst resends a single message
+        updates = [
+            UpdateOne(
+                {"user_id": user_id, "chat_id": chat_id},
+                {
+                    "$max": {"timestamp": timestamp},
+                    "$set": {"message_id": message_id, "updated_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+            for (user_id, chat_id), (timestamp, message_id) in delivered.items()
+        ]
+        
+        try:
+            await database.delivery_cursors.bulk_write(updates, ordered=False)
+        except Exception:
+            # Keep the positions for the next flush
+            for (user_id, chat_id), position in delivered.items():
+                self.connection_manager.record_delivery(user_id, chat_id, position)
+            raise
+    
+    async def sync_missed_messages(self, database, connection: ClientConnection) -> int:
+        """Stream the messages and read receipts a user missed while offline.
+        
+        Every chat contributes one clause of a single query over the
+        {chat_id, timestamp} index, starting at the user's delivery cursor
+        (or their last read time when there is none). Messages are sent in
+        batched "sync" frames, the last one marked done.
+        """
+        user_id = connection.user_id
+        persisted = {}
+        async for cursor_doc in database.delivery_cursors.find(
+            {"user_id": user_id}, {"_id": 0, "chat_id": 1, "timestamp": 1, "message_id": 1}
+        ):
+            persisted[cursor_doc["chat_id"]] = (cursor_doc["timestamp"], cursor_doc["message_id"])
+        
+        clauses = []
+        receipts = []
+        chats_cursor = database.chats.find(
+            {"participants.user_id": user_id},
+            {"_id": 0, "id": 1, "created_at": 1, "participants.user_id": 1, "participants.last_read_at": 1}
+        )
+        async for chat_doc in chats_cursor:
+            chat_id = chat_doc["id"]
+            positions = [p for p in (persisted.get(chat_id), self.connection_manager.delivered.get((user_id, chat_id))) if p]
+            participants = chat_doc.get("participants", [])
+            
+            if positions:
+                since, message_id = max(positions)
+                # $gte plus $ne keeps messages sharing the cursor's timestamp
+                clauses.append({"chat_id": chat_id, "timestamp": {"$gte": since}, "id": {"$ne": message_id}})
+            else:
+                own = next((p for p in participants if p["user_id"] == user_id), {})
+                since = own.get("last_read_at") or chat_doc["created_at"]
+                clauses.append({"chat_id": chat_id, "timestamp": {"$gt": since}})
+            
+            for participant in participants:
+                last_read_at = participant.get("last_read_at")
+                if participant["user_id"] != user_id and last_read_at and last_read_at > since:
+                    receipts.append({"chat_id": chat_id, "user_id": participant["user_id"], "last_read_at": last_read_at})
+        
+        messages = []
+        if clauses:
+            messages_cursor = database.chat_messages.find(
+                {"$or": clauses},
+                {"_id": 0, "search_tokens": 0},
+                sort=[("timestamp", 1), ("id", 1)]
+            ).limit(CHAT_SYNC_MAX_MESSAGES + 1)
+            async for message_doc in messages_cursor:
+                messages.append(ChatMessage(**message_doc))
+        
+        truncated = len(messages) > CHAT_SYNC_MAX_MESSAGES
+        messages = await self.decrypt_messages(messages[:CHAT_SYNC_MAX_MESSAGES])
+        
+        batches = [messages[i:i + CHAT_SYNC_BATCH_SIZE] for i in range(0, len(messages), CHAT_SYNC_BATCH_SIZE)] or [[]]
+        for index, batch in enumerate(batches):
+            done = index == len(batches) - 1
+            data = {"messages": [message.dict() for message in batch], "done": done}
+            if index == 0:
+                data["receipts"] = receipts
+            if done:
+                # Too many missed messages; the client should refetch its chats
+                data["truncated"] = truncated
+            # Messages are in order, so the last one of each chat is its position
+            positions = {message.chat_id: (message.timestamp, message.id) for message in batch}
+            message = WSMessage(type=WSMessageType.SYNC, data=data)
+            connection.enqueue(message.type, encode_frame(message), tuple(positions.items()))
+        return len(messages)
     
     async def create_chat(self, database, initiator_id: str, recipient_id: str, product_id: Optional[str] = None) -> Chat:
         """Create a new chat between two users"""
         
+        pair_key = chat_pair_key(initiator_id, recipient_id, product_id)
+        
         # Check if chat already exists between these users for this product
-        existing_chat = await database.chats.find_one({
-            "$and": [
-                {"participants.user_id": {"$all": [initiator_id, recipient_id]}},
-                {"product_id": product_id} if product_id else {"product_id": None}
-            ]
-        })
+        existing_chat = await database.chats.find_one({"pair_key": pair_key})
         
         if existing_chat:
             return Chat(**existing_chat)
         
         # Get user information
-        initiator = await database.users.find_one({"id": initiator_id})
-        recipient = await database.users.find_one({"id": recipient_id})
+        users = {
+            user["id"]: user
+            async for user in database.users.find(
+                {"id": {"$in": [initiator_id, recipient_id]}},
+                {"_id": 0, "id": 1, "firstName": 1, "lastName": 1, "userType": 1}
+            )
+        }
+        initiator = users.get(initiator_id)
+        recipient = users.get(recipient_id)
         
         if not initiator or not recipient:
             raise ValueError("Invalid user IDs")
@@ -190,7 +1107,7 @@ class ChatService:
         # Get product information if provided
         product_name = None
         if product_id:
-            product = await database.products.find_one({"id": product_id})
+            product = await database.products.find_one({"id": product_id}, {"_id": 0, "name": 1})
             if product:
                 product_name = product["name"]
         
@@ -214,39 +1131,167 @@ class ChatService:
             participants=participants,
             product_id=product_id,
             product_name=product_name,
+            pair_key=pair_key,
             created_at=datetime.now(),
             updated_at=datetime.now(),
             unread_count={initiator_id: 0, recipient_id: 0}
         )
         
-        # Save to database
-        await database.chats.insert_one(chat.dict())
+        # Save to database; a concurrent create for the same pair wins the
+        # unique pair_key and both callers get its chat back
+        try:
+            chat_doc = await database.chats.find_one_and_update(
+                {"pair_key": pair_key},
+                {"$setOnInsert": chat.dict()},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            chat_doc = await database.chats.find_one({"pair_key": pair_key})
+        chat = Chat(**chat_doc)
+        
+        self.chat_members.set(chat.id, {p.user_id: p.user_name for p in chat.participants})
+        await self.connection_manager.add_contacts(initiator_id, recipient_id)
         
         return chat
     
+    async def get_chat_summaries(self, database, user_id: str, skip: int, limit: int) -> Tuple[List[dict], int, int]:
+        """Get a page of compact chat rows with the total count and global unread total.
+        
+        One aggregation walks the {participants.user_id, updated_at} index and
+        a $facet returns the page alongside the totals over all of the user's chats.
+        """
+        pipeline = [
+            {"$match": {"participants.user_id": user_id, "status": {"$ne": "deleted"}}},
+            {"$sort": {"updated_at": -1}},
+            {"$facet": {
+                "chats": [
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$project": {
+                        "_id": 0,
+                        "id": 1,
+                        "participants": 1,
+                        "product_id": 1,
+                        "product_name": 1,
+                        "status": 1,
+                        "updated_at": 1,
+                        "last_message.id": 1,
+                        "last_message.sender_id": 1,
+                        "last_message.sender_name": 1,
+                        "last_message.message_type": 1,
+                        "last_message.timestamp": 1,
+                        "last_message.content.text": 1,
+                        "last_message.content.ciphertext": 1,
+                        "last_message.content.key_version": 1,
+                        "last_message.content.media_type": 1,
+                        "unread": {"$ifNull": [f"$unread_count.{user_id}", 0]}
+                    }}
+                ],
+                "totals": [
+                    {"$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "unread": {"$sum": {"$ifNull": [f"$unread_count.{user_id}", 0]}}
+                    }}
+                ]
+            }}
+        ]
+        
+        result = await database.chats.aggregate(pipeline).to_list(1)
+        facets = result[0] if result else {"chats": [], "totals": []}
+        totals = facets["totals"][0] if facets["totals"] else {"count": 0, "unread": 0}
+        
+        chats = facets["chats"]
+        for chat in chats:
+            chat["unread_count"] = {user_id: chat.pop("unread")}
+            if chat.get("last_message"):
+                chat["last_message"]["content"] = self._preview_content(chat["last_message"])
+            else:
+                chat["last_message"] = None
+        return chats, totals["count"], totals["unread"]
+    
+    def _preview_content(self, last_message: dict) -> dict:
+        """Decrypt and truncate a last message for the chat list, cached by message id"""
+        content = last_message.get("content", {})
+        preview = {"text": None, "media_type": content.get("media_type")}
+        if last_message.get("message_type") != MessageType.TEXT:
+            return preview
+        
+        text = self.preview_cache.get(last_message["id"])
+        if text is None:
+            if content.get("ciphertext") is not None:
+                text = self.encryption.decrypt_message(content["ciphertext"], content.get("key_version"))
+            elif content.get("text"):
+                text = self.encryption.decrypt_message(content["text"])
+            else:
+                text = ""
+            text = text[:CHAT_PREVIEW_LENGTH]
+            self.preview_cache.set(last_message["id"], text)
+        preview["text"] = text
+        return preview
+    
+    async def load_chat_contacts(self, database, user_id: str) -> Set[str]:
+        """Get the ids of every user sharing a chat with user_id"""
+        contacts = set()
+        cursor = database.chats.find(
+            {"participants.user_id": user_id},
+            {"_id": 0, "participants.user_id": 1}
+        )
+        async for chat_doc in cursor:
+            for participant in chat_doc.get("participants", []):
+                if participant["user_id"] != user_id:
+                    contacts.add(participant["user_id"])
+        return contacts
+    
+    async def get_chat_members(self, database, chat_id: str) -> Optional[Dict[str, str]]:
+        """Get a chat's participants as user_id -> user_name, or None if it doesn't exist"""
+        members = self.chat_members.get(chat_id)
+        if members is None:
+            chat_doc = await database.chats.find_one(
+                {"id": chat_id},
+                {"_id": 0, "participants.user_id": 1, "participants.user_name": 1}
+            )
+            if not chat_doc:
+                return None
+            members = {p["user_id"]: p["user_name"] for p in chat_doc["participants"]}
+            self.chat_members.set(chat_id, members)
+        return members
+    
     async def send_message(self, database, sender_id: str, chat_id: str, content: MessageContent, 
                           message_type: MessageType = MessageType.TEXT, reply_to: Optional[str] = None) -> ChatMessage:
         """Send a message in a chat"""
         
-        # Get chat and verify sender is participant
-        chat_doc = await database.chats.find_one({"id": chat_id})
-        if not chat_doc:
+        # Verify sender is participant
+        members = await self.get_chat_members(database, chat_id)
+        if members is None:
             raise ValueError("Chat not found")
         
-        chat = Chat(**chat_doc)
-        sender_participant = None
-        for participant in chat.participants:
-            if participant.user_id == sender_id:
-                sender_participant = participant
-                break
-        
-        if not sender_participant:
+        if sender_id not in members:
             raise ValueError("User is not a participant in this chat")
         
+        # Attachments must be uploaded first; messages only carry a reference
+        if content.media_url is not None:
+            raise ValueError("Upload media to /api/chat/media and send its media_id")
+        if content.media_id is not None:
+            media = await self.get_media(database, content.media_id)
+            if media is None:
+                raise ValueError("Media not found")
+            content = content.copy(update={
+                "media_type": media["content_type"],
+                "file_size": media["size"],
+                "width": media.get("width"),
+                "height": media.get("height")
+            })
+        
         # Encrypt message content if it's text
-        encrypted_content = content.copy()
+        encrypted_content = StoredMessageContent(**content.dict())
         if message_type == MessageType.TEXT and content.text:
-            encrypted_content.text = self.encryption.encrypt_message(content.text)
+            ciphertext = self.encryption.encrypt_message(content.text)
+            if ciphertext is not None:
+                encrypted_content.text = None
+                encrypted_content.ciphertext = ciphertext
+                encrypted_content.key_version = self.encryption.version
         
         # Create message
         message_id = str(uuid.uuid4())
@@ -254,37 +1299,53 @@ class ChatService:
             id=message_id,
             chat_id=chat_id,
             sender_id=sender_id,
-            sender_name=sender_participant.user_name,
+            sender_name=members[sender_id],
             message_type=message_type,
             content=encrypted_content,
             timestamp=datetime.now(),
             reply_to=reply_to
         )
         
-        # Save message to database
-        await database.chat_messages.insert_one(message.dict())
+        # Save message to database; ciphertext is excluded from dict() output
+        message_doc = message.dict()
+        message_doc["content"]["ciphertext"] = encrypted_content.ciphertext
+        message_doc["content"]["key_version"] = encrypted_content.key_version
+        # Keyed word hashes let the encrypted text be searched
+        message_doc["search_tokens"] = self.search_index.tokens(chat_id, content.text)
+        await self.writes.insert_one(database.chat_messages, message_doc)
         
-        # Update chat with last message and unread counts
-        unread_count = chat.unread_count.copy()
-        for participant in chat.participants:
-            if participant.user_id != sender_id:
-                unread_count[participant.user_id] = unread_count.get(participant.user_id, 0) + 1
+        # Update chat with a compact last message and atomic unread counts
+        last_message = {
+            field: message_doc[field]
+            for field in ("id", "chat_id", "sender_id", "sender_name", "message_type", "timestamp")
+        }
+        # Legacy media data can be megabytes of base64; the preview never needs it
+        last_message["content"] = {
+            key: value for key, value in message_doc["content"].items()
+            if key != "media_url" and value is not None
+        }
         
-        await database.chats.update_one(
+        await self.writes.update_one(
+            database.chats,
             {"id": chat_id},
             {
                 "$set": {
-                    "updated_at": datetime.now(),
-                    "last_message": message.dict(),
-                    "unread_count": unread_count
+                    "updated_at": message.timestamp,
+                    "last_message": last_message
+                },
+                "$inc": {
+                    f"unread_count.{user_id}": 1
+                    for user_id in members if user_id != sender_id
                 }
             }
         )
         
-        # Send real-time notification
-        decrypted_message = message.copy()
-        if message_type == MessageType.TEXT and encrypted_content.text:
-            decrypted_message.content.text = self.encryption.decrypt_message(encrypted_content.text)
+        if message_type == MessageType.TEXT:
+            self.preview_cache.set(message_id, (content.text or "")[:CHAT_PREVIEW_LENGTH])
+        
+        # Send real-time notification with the plaintext we already have
+        decrypted_message = message.copy(update={"content": content.copy()})
+        self.sign_media_url(decrypted_message)
         
         ws_message = WSMessage(
             type=WSMessageType.NEW_MESSAGE,
@@ -292,10 +1353,66 @@ class ChatService:
             sender_id=sender_id
         )
         
-        await self.connection_manager.send_to_chat(chat_id, ws_message, exclude_user=sender_id)
+        # The sender already has the message; everyone reached live is up to date
+        position = (message.timestamp, message.id)
+        self.connection_manager.record_delivery(sender_id, chat_id, position)
+        await self.connection_manager.send_to_chat(
+            chat_id, ws_message, exclude_user=sender_id, position=position
+        )
         
         return decrypted_message
     
+    async def get_messages_page(self, database, chat_id: str, limit: int,
+                                before: Optional[str] = None,
+                                after: Optional[str] = None,
+                                search_tokens: Optional[List[bytes]] = None) -> Tuple[List[ChatMessage], bool]:
+        """Get one page of messages relative to a cursor message, oldest first.
+        
+        Walks the {chat_id, timestamp, id} index from the cursor, so every
+        page costs the same regardless of depth. Returns the messages and
+        whether more exist beyond them. Raises ValueError for an unknown cursor.
+        With ``search_tokens`` only messages carrying all of them are returned.
+        """
+        query = {"chat_id": chat_id}
+        if search_tokens:
+            query["search_tokens"] = {"$all": search_tokens}
+        direction = -1
+        cursor_id = before or after
+        if cursor_id:
+            anchor = await database.chat_messages.find_one(
+                {"id": cursor_id, "chat_id": chat_id},
+                {"_id": 0, "id": 1, "timestamp": 1}
+            )
+            if not anchor:
+                raise ValueError("Invalid message cursor")
+            
+            op = "$lt" if before else "$gt"
+            if after:
+                direction = 1
+            # Messages sharing the anchor's timestamp are ordered by id
+            query["$or"] = [
+                {"timestamp": {op: anchor["timestamp"]}},
+                {"timestamp": anchor["timestamp"], "id": {op: anchor["id"]}}
+            ]
+        
+        # Fetch one extra message to learn whether another page exists
+        messages_cursor = database.chat_messages.find(
+            query,
+            {"_id": 0, "search_tokens": 0},
+            sort=[("timestamp", direction), ("id", direction)]
+        ).limit(limit + 1)
+        
+        messages = []
+        async for message_doc in messages_cursor:
+            messages.append(ChatMessage(**message_doc))
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if direction == -1:
+            # Reverse to get chronological order (oldest first)
+            messages.reverse()
+        return messages, has_more
+    
     async def mark_messages_read(self, database, user_id: str, chat_id: str):
         """Mark all messages in a chat as read for a user"""
         
@@ -320,15 +1437,73 @@ class ChatService:
         
         await self.connection_manager.send_to_chat(chat_id, ws_message, exclude_user=user_id)
     
-    def decrypt_messages(self, messages: List[ChatMessage]) -> List[ChatMessage]:
-        """Decrypt text messages for display"""
-        decrypted_messages = []
-        for message in messages:
-            decrypted_message = message.copy()
-            if message.message_type == MessageType.TEXT and message.content.text:
-                decrypted_message.content.text = self.encryption.decrypt_message(message.content.text)
-            decrypted_messages.append(decrypted_message)
-        return decrypted_messages
+    async def store_media(self, database, chunks, content_type: str, filename: Optional[str],
+                          uploaded_by: str) -> dict:
+        """Stream an attachment into blob storage and record its metadata"""
+        media_id, size = await self.media.save(chunks)
+        if size == 0:
+            raise ValueError("Attachment is empty")
+        width, height = None, None
+        if content_type.startswith("image/"):
+            loop = asyncio.get_running_loop()
+            width, height = await loop.run_in_executor(None, self.media.image_dimensions, media_id)
+        
+        # Identical uploads share one blob and one metadata document
+        await database.chat_media.update_one(
+            {"id": media_id},
+            {"$set": {"last_uploaded_at": datetime.utcnow()}, "$setOnInsert": {
+                "id": media_id,
+                "content_type": content_type,
+                "size": size,
+                "width": width,
+                "height": height,
+                "uploaded_by": uploaded_by,
+                "created_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+        return {
+            "media_id": media_id,
+            "media_type": content_type,
+            "file_size": size,
+            "width": width,
+            "height": height,
+            "filename": filename,
+            "media_url": self.media.signed_url(media_id)
+        }
+    
+    async def get_media(self, database, media_id: str) -> Optional[dict]:
+        return await database.chat_media.find_one({"id": media_id}, {"_id": 0})
+    
+    def sign_media_url(self, message: ChatMessage) -> ChatMessage:
+        """Point an attachment reference at a signed download link, in place"""
+        if message.content.media_id:
+            message.content.media_url = self.media.signed_url(message.content.media_id)
+        return message
+    
+    def decrypt_message(self, message: ChatMessage) -> ChatMessage:
+        """Decrypt a message for display and sign its media link, in place"""
+        content = message.content
+        self.sign_media_url(message)
+        if message.message_type != MessageType.TEXT:
+            return message
+        if content.ciphertext is not None:
+            content.text = self.encryption.decrypt_message(content.ciphertext, content.key_version)
+            content.ciphertext = None
+            content.key_version = None
+        elif content.text:
+            content.text = self.encryption.decrypt_message(content.text)
+        return message
+    
+    def _decrypt_batch(self, messages: List[ChatMessage]) -> List[ChatMessage]:
+        return [self.decrypt_message(message) for message in messages]
+    
+    async def decrypt_messages(self, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """Decrypt a page of messages in place, in one batch on the thread pool"""
+        if not messages:
+            return []
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._decrypt_batch, messages)
 
 # Global chat service instance
 chat_service = ChatService()
\ No newline at end of file
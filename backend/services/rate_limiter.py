@@ -0,0 +1,188 @@
+import os
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, Request, status
+from pymongo import ReturnDocument
+
+# Rate limiter configuration
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# Reverse proxies in front of the app that append to X-Forwarded-For
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", 0))
+
+# Limits per endpoint: scope -> (requests, window seconds)
+RATE_LIMITS = {
+    "login": {"ip": (20, 60), "email": (5, 60)},
+    "register": {"ip": (10, 3600)},
+    "forgot_password": {"ip": (5, 900), "email": (3, 3600)},
+    "reset_password": {"ip": (10, 900)},
+    "admin_login": {"ip": (10, 60), "email": (5, 300)},
+    "chat_media_upload": {"ip": (60, 60), "user": (30, 600)},
+}
+
+
+def sliding_window_retry_after(window_start: float, previous: int, current: int,
+                               limit: int, window: int, now: float) -> float:
+    """Return seconds until a request would be allowed, or 0 if allowed now.
+
+    Approximates a sliding window with the counts of the current and previous
+    fixed windows, weighting the previous one by how much of it still
+    overlaps the sliding window.
+    """
+    elapsed = now - window_start
+    estimate = previous * (1 - elapsed / window) + current
+    if estimate <= limit:
+        return 0
+    if current > limit or previous == 0:
+        return window - elapsed
+    # previous * (1 - t / window) + current <= limit
+    allowed_at = window * (1 - (limit - current) / previous)
+    return max(allowed_at - elapsed, 1)
+
+
+class InMemoryRateLimitBackend:
+    """Per-process sliding window counters.
+
+    Each key keeps two counters and a window start, so memory per key is
+    constant. Keys are kept in LRU order and evicted once idle for two
+    windows or when ``max_keys`` is exceeded.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> (window_start, previous_count, current_count, window, last_seen)
+        self._counters: "OrderedDict[str, Tuple[float, int, int, int, float]]" = OrderedDict()
+
+    def _evict_idle(self, now: float):
+        while self._counters:
+            key, (_, _, _, window, last_seen) = next(iter(self._counters.items()))
+            if now - last_seen < 2 * window and len(self._counters) <= self.max_keys:
+                break
+            del self._counters[key]
+
+    async def hit(self, key: str, limit: int, window: int) -> float:
+        """Record a hit and return the Retry-After delay (0 when allowed)"""
+        now = time.time()
+        window_start = now - (now % window)
+        entry = self._counters.get(key)
+
+        if entry is None:
+            previous, current = 0, 0
+        else:
+            entry_start, entry_previous, entry_current = entry[0], entry[1], entry[2]
+            if entry_start == window_start:
+                previous, current = entry_previous, entry_current
+            elif entry_start == window_start - window:
+                previous, current = entry_current, 0
+            else:
+                previous, current = 0, 0
+
+        current += 1
+        self._counters[key] = (window_start, previous, current, window, now)
+        self._counters.move_to_end(key)
+        self._evict_idle(now)
+
+        return sliding_window_retry_after(window_start, previous, current, limit, window, now)
+
+
+class MongoRateLimitBackend:
+    """Sliding window counters shared by every worker through Mongo.
+
+    Each hit is a single atomic ``find_one_and_update`` that rolls the window
+    and increments the counter server-side; idle keys are purged by a TTL
+    index on ``expires_at``.
+    """
+
+    def __init__(self, get_database):
+        self.get_database = get_database
+
+    async def hit(self, key: str, limit: int, window: int) -> float:
+        now = time.time()
+        window_start = now - (now % window)
+        previous_start = window_start - window
+
+        database = self.get_database()
+        if database is None:
+            return 0
+        counter = await database.rate_limits.find_one_and_update(
+            {"_id": key},
+            [{"$set": {
+                "previous": {"$cond": [
+                    {"$eq": ["$window_start", window_start]}, "$previous",
+                    {"$cond": [{"$eq": ["$window_start", previous_start]}, "$current", 0]}
+                ]},
+                "current": {"$cond": [
+                    {"$eq": ["$window_start", window_start]}, {"$add": ["$current", 1]}, 1
+                ]},
+                "window_start": window_start,
+                "expires_at": datetime.utcnow() + timedelta(seconds=2 * window)
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        return sliding_window_retry_after(
+            window_start, counter["previous"], counter["current"], limit, window, now
+        )
+
+
+def get_client_ip(request: Request, trusted_proxies: int = RATE_LIMIT_TRUSTED_PROXIES) -> str:
+    """Client address as seen by the outermost trusted proxy.
+
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client is the ``trusted_proxies``-th entry from
+    the right. Anything further left was supplied by the client and is
+    ignored.
+    """
+    if trusted_proxies > 0:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    """Apply the configured limits for an endpoint scope"""
+
+    def __init__(self, backend, limits: Dict[str, Dict[str, Tuple[int, int]]] = RATE_LIMITS):
+        self.backend = backend
+        self.limits = limits
+
+    async def check(self, scope: str, request: Request, email: Optional[str] = None,
+                    user_id: Optional[str] = None):
+        """Raise 429 with Retry-After if any limit for the scope is exceeded"""
+        retry_after = 0
+        for dimension, (limit, window) in self.limits.get(scope, {}).items():
+            if dimension == "ip":
+                identity = get_client_ip(request)
+            elif dimension == "user" and user_id:
+                identity = user_id
+            elif dimension == "email" and email:
+                identity = email.lower()
+            else:
+                continue
+
+            delay = await self.backend.hit(f"{scope}:{dimension}:{identity}", limit, window)
+            retry_after = max(retry_after, delay)
+
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(int(math.ceil(retry_after)))}
+            )
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Build the limiter for the configured backend"""
+    if RATE_LIMIT_BACKEND == "mongo":
+        from database import get_database
+        return RateLimiter(MongoRateLimitBackend(get_database))
+    return RateLimiter(InMemoryRateLimitBackend())
+
+
+# Global rate limiter instance
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,125 @@
+import os
+import math
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Typing indicator configuration
+TYPING_MIN_INTERVAL_SECONDS = float(os.getenv("TYPING_MIN_INTERVAL_SECONDS", 1.0))
+TYPING_TIMEOUT_SECONDS = float(os.getenv("TYPING_TIMEOUT_SECONDS", 5.0))
+TYPING_TICK_SECONDS = 0.25
+
+TypingKey = Tuple[str, str]
+TypingEmitter = Callable[[str, str, bool], Awaitable[None]]
+
+
+class TypingState:
+    """Typing state of one user in one chat"""
+
+    __slots__ = ("announced", "desired", "last_emit", "expires_at", "scheduled_at")
+
+    def __init__(self):
+        # What subscribers were last told, and what the client last asked for
+        self.announced = False
+        self.desired = False
+        self.last_emit = -math.inf
+        self.expires_at = 0.0
+        # Deadline of the wheel slot holding this key, if any
+        self.scheduled_at: Optional[float] = None
+
+
+class TypingDebouncer:
+    """Debounce typing indicators per user and chat on a single timer wheel.
+
+    Keystroke frames only refresh a deadline. Subscribers see at most one
+    state change per ``interval`` and a "stopped" once the client has been
+    silent for ``timeout``. Deadlines live in a hashed wheel of ``slots``
+    buckets advanced by one task, which only runs while someone is typing.
+    """
+
+    def __init__(self, emit: TypingEmitter,
+                 interval: float = TYPING_MIN_INTERVAL_SECONDS,
+                 timeout: float = TYPING_TIMEOUT_SECONDS,
+                 tick: float = TYPING_TICK_SECONDS,
+                 slots: int = 64):
+        self.emit = emit
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self._states: Dict[TypingKey, TypingState] = {}
+        self._wheel: List[Set[TypingKey]] = [set() for _ in range(slots)]
+        self._position = int(time.monotonic() // tick)
+        self._task: Optional[asyncio.Task] = None
+
+    async def update(self, user_id: str, chat_id: str, is_typing: bool):
+        """Record a typing frame from a client"""
+        key = (user_id, chat_id)
+        state = self._states.get(key)
+        if state is None:
+            if not is_typing:
+                return
+            state = self._states[key] = TypingState()
+
+        now = time.monotonic()
+        state.desired = is_typing
+        if is_typing:
+            state.expires_at = now + self.timeout
+        await self._advance(key, state, now)
+
+        if self._task is None or self._task.done():
+            self._position = int(now // self.tick)
+            self._task = asyncio.create_task(self._run())
+
+    async def _advance(self, key: TypingKey, state: TypingState, now: float):
+        """Emit a due state change, then reschedule or forget the key"""
+        if state.announced and now >= state.expires_at:
+            state.desired = False
+
+        if state.desired != state.announced and now - state.last_emit >= self.interval:
+            state.announced = state.desired
+            state.last_emit = now
+            try:
+                await self.emit(key[0], key[1], state.announced)
+            except Exception as e:
+                print(f"Typing indicator error: {e}")
+
+        if state.desired != state.announced:
+            self._schedule(key, state, state.last_emit + self.interval)
+        elif state.announced:
+            self._schedule(key, state, state.expires_at)
+        else:
+            self._states.pop(key, None)
+
+    def _schedule(self, key: TypingKey, state: TypingState, deadline: float):
+        # An earlier visit reschedules anyway, so keystrokes don't touch the wheel
+        if state.scheduled_at is not None and state.scheduled_at <= deadline:
+            return
+        state.scheduled_at = deadline
+        slot = int(math.ceil(deadline / self.tick)) % len(self._wheel)
+        self._wheel[slot].add(key)
+
+    async def _run(self):
+        """Advance the wheel until nobody is typing"""
+        while self._states:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            current = int(now // self.tick)
+            # Visit every slot passed since the last tick, at most one lap
+            first = max(self._position + 1, current - len(self._wheel) + 1)
+            for position in range(first, current + 1):
+                bucket = self._wheel[position % len(self._wheel)]
+                if not bucket:
+                    continue
+                keys = list(bucket)
+                bucket.clear()
+                for key in keys:
+                    state = self._states.get(key)
+                    if state is not None:
+                        # Keys due in a later lap are simply rescheduled
+                        state.scheduled_at = None
+                        await self._advance(key, state, now)
+            self._position = current
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,100 @@
+import os
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Group commit configuration
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", 2))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", 500))
+
+
+class WriteBatcher:
+    """Group-commit writes issued within a few milliseconds of each other.
+
+    Writes are queued per collection and flushed together, inserts with
+    ``insert_many`` and mixed batches with ``bulk_write``. Each caller awaits
+    a future resolved once its own write is acknowledged, so the durability
+    of a write is unchanged; only the round-trips are shared. Batches are
+    ordered and each collection flushes one batch at a time, so writes to a
+    collection apply in the order they were issued.
+    """
+
+    def __init__(self, delay_ms: float = WRITE_BATCH_DELAY_MS, max_size: int = WRITE_BATCH_MAX_SIZE):
+        self.delay = delay_ms / 1000
+        self.max_size = max_size
+        # collection full name -> (collection, [(operation, inserted document, future)], flush timer)
+        self._pending: Dict[str, Tuple[object, List[Tuple[object, Optional[dict], asyncio.Future]], asyncio.TimerHandle]] = {}
+        # collection full name -> latest flush, which the next one waits for
+        self._flushing: Dict[str, asyncio.Task] = {}
+
+    async def insert_one(self, collection, document: dict):
+        """Insert a document as part of the next batch"""
+        await self._submit(collection, InsertOne(document), document)
+
+    async def update_one(self, collection, filter: dict, update, upsert: bool = False):
+        """Update a document as part of the next batch"""
+        await self._submit(collection, UpdateOne(filter, update, upsert=upsert))
+
+    async def _submit(self, collection, operation, document: Optional[dict] = None):
+        future = asyncio.get_running_loop().create_future()
+        key = collection.full_name
+        if key not in self._pending:
+            timer = asyncio.get_running_loop().call_later(self.delay, self._start_flush, key)
+            self._pending[key] = (collection, [], timer)
+        batch = self._pending[key][1]
+        batch.append((operation, document, future))
+        if len(batch) >= self.max_size:
+            self._start_flush(key)
+        await future
+
+    def _start_flush(self, key: str):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        collection, batch, timer = pending
+        # A full batch flushes early; its timer must not cut the next batch short
+        timer.cancel()
+        task = asyncio.create_task(self._flush_after(self._flushing.get(key), collection, batch))
+        self._flushing[key] = task
+        task.add_done_callback(lambda done: self._forget_flush(key, done))
+
+    def _forget_flush(self, key: str, task: asyncio.Task):
+        if self._flushing.get(key) is task:
+            del self._flushing[key]
+
+    async def _flush_after(self, previous: Optional[asyncio.Task], collection, batch):
+        # Flushes of a collection are chained so batches apply in order
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self._flush(collection, batch)
+
+    async def _flush(self, collection, batch: List[Tuple[object, Optional[dict], asyncio.Future]]):
+        try:
+            if all(document is not None for _, document, _ in batch):
+                await collection.insert_many([document for _, document, _ in batch], ordered=True)
+            else:
+                await collection.bulk_write([operation for operation, _, _ in batch], ordered=True)
+        except BulkWriteError as e:
+            # An ordered batch stops at the first error; later writes never ran
+            errors = e.details.get("writeErrors", [])
+            failed_at = errors[0]["index"] if errors else 0
+            for index, (_, _, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if index < failed_at:
+                    future.set_result(None)
+                elif index == failed_at:
+                    future.set_exception(BulkWriteError({"writeErrors": errors[:1]}))
+                else:
+                    future.set_exception(RuntimeError("Batched write not applied after an earlier failure"))
+            return
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
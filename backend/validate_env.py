@@ -21,7 +21,9 @@ def validate_environment():
     
     required_vars = {
         'MONGO_URL': 'MongoDB connection string',
-        'JWT_SECRET': 'JWT secret key for authentication'
+        'JWT_SECRET': 'JWT secret key for authentication',
+        'CHAT_ENCRYPTION_KEY': 'Fernet key for chat message encryption',
+        'CHAT_SEARCH_KEY': 'HMAC key for the chat search index'
     }
     
     missing_vars = []
@@ -1392,7 +1392,7 @@ class BackendTester:
             return False
     
     def test_get_chat_messages(self):
-        """Test GET /api/chat/{chat_id}/messages endpoint"""
+        """Test GET /api/chat/{chat_id}/messages endpoint with before/after cursors"""
         if not hasattr(self, 'chat_id') or not self.chat_id:
             self.log_test("Get Chat Messages", False, "No chat ID available", "Chat creation may have failed")
             return False
@@ -1400,7 +1400,7 @@ class BackendTester:
         try:
             headers = {"Authorization": f"Bearer {self.buyer_token}"}
             response = requests.get(
-                f"{self.base_url}/api/chat/{self.chat_id}/messages?page=1&limit=50",
+                f"{self.base_url}/api/chat/{self.chat_id}/messages?limit=50",
                 headers=headers,
                 timeout=10
             )
@@ -1409,18 +1409,15 @@ class BackendTester:
                 data = response.json()
                 if (data.get("messages") is not None and
                     data.get("chat_info") and
-                    data.get("total_count") is not None and
+                    isinstance(data.get("has_more"), bool) and
                     len(data["messages"]) > 0):
                     
                     # Verify message structure and decryption
                     message = data["messages"][0]
-                    if (message.get("id") and 
+                    if not (message.get("id") and 
                         message.get("content") and
                         message["content"].get("text") and
                         not message["content"]["text"].startswith("gAAAAA")):  # Should be decrypted, not encrypted
-                        self.log_test("Get Chat Messages", True, f"Retrieved {len(data['messages'])} messages, messages properly decrypted")
-                        return True
-                    else:
                         self.log_test("Get Chat Messages", False, "Messages not properly decrypted or invalid structure", message)
                         return False
                 else:
@@ -1429,6 +1426,42 @@ class BackendTester:
             else:
                 self.log_test("Get Chat Messages", False, f"HTTP {response.status_code}", response.text)
                 return False
+            
+            # Page backwards one message at a time: the newest page, then the one before it
+            first_page = requests.get(
+                f"{self.base_url}/api/chat/{self.chat_id}/messages?limit=1",
+                headers=headers,
+                timeout=10
+            ).json()
+            if len(first_page.get("messages", [])) != 1 or first_page.get("has_more") is not True:
+                self.log_test("Get Chat Messages", False, "First page should hold one message and report more", first_page)
+                return False
+            newest = first_page["messages"][0]
+            
+            second_page = requests.get(
+                f"{self.base_url}/api/chat/{self.chat_id}/messages?before={newest['id']}&limit=1",
+                headers=headers,
+                timeout=10
+            ).json()
+            if (len(second_page.get("messages", [])) != 1 or
+                second_page["messages"][0]["id"] == newest["id"] or
+                second_page["messages"][0]["timestamp"] > newest["timestamp"]):
+                self.log_test("Get Chat Messages", False, "Second page should hold the next older message", second_page)
+                return False
+            older = second_page["messages"][0]
+            
+            # Paging forward from the older message leads back to the newest one
+            newer_page = requests.get(
+                f"{self.base_url}/api/chat/{self.chat_id}/messages?after={older['id']}&limit=1",
+                headers=headers,
+                timeout=10
+            ).json()
+            if [m["id"] for m in newer_page.get("messages", [])] != [newest["id"]]:
+                self.log_test("Get Chat Messages", False, "Paging after the older message should return the newest", newer_page)
+                return False
+            
+            self.log_test("Get Chat Messages", True, f"Retrieved {len(data['messages'])} messages, messages properly decrypted, cursor paging works")
+            return True
         except Exception as e:
             self.log_test("Get Chat Messages", False, "Request failed", str(e))
             return False
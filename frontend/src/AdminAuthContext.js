@@ -1,4 +1,5 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
+import { saveSession, clearSession } from './authSession';
 
 const AdminAuthContext = createContext();
 
@@ -31,11 +32,11 @@ export const AdminAuthProvider = ({ children }) => {
             setAdmin(data.admin);
             setIsAuthenticated(true);
           } else {
-            localStorage.removeItem('admin_token');
+            clearSession('admin');
           }
         } catch (error) {
           console.error('Auth check failed:', error);
-          localStorage.removeItem('admin_token');
+          clearSession('admin');
         }
       }
       setLoading(false);
@@ -57,7 +58,7 @@ export const AdminAuthProvider = ({ children }) => {
       const data = await response.json();
 
       if (response.ok && data.success) {
-        localStorage.setItem('admin_token', data.token);
+        saveSession('admin', data.token, data.refresh_token);
         setAdmin(data.admin);
         setIsAuthenticated(true);
         return { success: true };
@@ -70,7 +71,7 @@ export const AdminAuthProvider = ({ children }) => {
   };
 
   const logout = () => {
-    localStorage.removeItem('admin_token');
+    clearSession('admin');
     setAdmin(null);
     setIsAuthenticated(false);
   };
@@ -1,4 +1,5 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
+import { saveSession, clearSession } from './authSession';
 
 const AuthContext = createContext();
 
@@ -28,22 +29,20 @@ export const AuthProvider = ({ children }) => {
         setUser(parsedUser);
       } catch (error) {
         console.error('Error parsing user data:', error);
-        localStorage.removeItem('auth_token');
-        localStorage.removeItem('user_data');
+        clearSession('user');
       }
     }
     setLoading(false);
   };
 
-  const login = (userData, token) => {
-    localStorage.setItem('auth_token', token);
+  const login = (userData, token, refreshToken) => {
+    saveSession('user', token, refreshToken);
     localStorage.setItem('user_data', JSON.stringify(userData));
     setUser(userData);
   };
 
   const logout = () => {
-    localStorage.removeItem('auth_token');
-    localStorage.removeItem('user_data');
+    clearSession('user');
     localStorage.removeItem('cart');
     setUser(null);
   };
@@ -0,0 +1,118 @@
+import axios from 'axios';
+
+const API_BASE = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+
+// Access tokens are short-lived; each session keeps a refresh token next to them
+const SESSIONS = {
+  user: { token: 'auth_token', refresh: 'refresh_token', loginPath: '/login', area: '/', extra: ['user_data'] },
+  admin: { token: 'admin_token', refresh: 'admin_refresh_token', loginPath: '/admin/login', area: '/admin', extra: [] }
+};
+
+const pendingRefreshes = {};
+
+export const saveSession = (kind, token, refreshToken) => {
+  const keys = SESSIONS[kind];
+  localStorage.setItem(keys.token, token);
+  if (refreshToken) {
+    localStorage.setItem(keys.refresh, refreshToken);
+  }
+};
+
+export const clearSession = (kind) => {
+  const keys = SESSIONS[kind];
+  [keys.token, keys.refresh, ...keys.extra].forEach((key) => localStorage.removeItem(key));
+};
+
+// Which session a bearer token belongs to, if any
+const sessionForToken = (token) =>
+  Object.keys(SESSIONS).find((kind) => token && localStorage.getItem(SESSIONS[kind].token) === token);
+
+const bearerToken = (authorization) =>
+  authorization && authorization.startsWith('Bearer ') ? authorization.slice(7) : null;
+
+// Concurrent 401s share one refresh, since refresh tokens are single use
+export const refreshSession = (kind) => {
+  if (!pendingRefreshes[kind]) {
+    const keys = SESSIONS[kind];
+    pendingRefreshes[kind] = (async () => {
+      const refreshToken = localStorage.getItem(keys.refresh);
+      if (!refreshToken) {
+        throw new Error('No refresh token');
+      }
+      const response = await axios.post(
+        `${API_BASE}/api/auth/refresh`,
+        { refresh_token: refreshToken },
+        { skipAuthRefresh: true }
+      );
+      saveSession(kind, response.data.token, response.data.refresh_token);
+      return response.data.token;
+    })()
+      .catch((error) => {
+        // The session is over; stop showing the user as logged in
+        clearSession(kind);
+        const path = window.location.pathname;
+        if (path.startsWith(keys.area) && path !== keys.loginPath) {
+          window.location.assign(keys.loginPath);
+        }
+        throw error;
+      })
+      .finally(() => {
+        delete pendingRefreshes[kind];
+      });
+  }
+  return pendingRefreshes[kind];
+};
+
+const installAxiosRefresh = () => {
+  axios.interceptors.response.use(undefined, async (error) => {
+    const config = error.config;
+    if (!config || config.skipAuthRefresh || config.retriedAfterRefresh || error.response?.status !== 401) {
+      throw error;
+    }
+    const headers = config.headers || {};
+    const authorization = typeof headers.get === 'function' ? headers.get('Authorization') : headers.Authorization;
+    const kind = sessionForToken(bearerToken(authorization));
+    if (!kind) {
+      throw error;
+    }
+
+    const token = await refreshSession(kind);
+    config.retriedAfterRefresh = true;
+    if (typeof headers.set === 'function') {
+      headers.set('Authorization', `Bearer ${token}`);
+    } else {
+      config.headers = { ...headers, Authorization: `Bearer ${token}` };
+    }
+    return axios.request(config);
+  });
+};
+
+const installFetchRefresh = () => {
+  const originalFetch = window.fetch.bind(window);
+  window.fetch = async (input, init = {}) => {
+    const response = await originalFetch(input, init);
+    if (response.status !== 401 || !init.headers) {
+      return response;
+    }
+    const headers = new Headers(init.headers);
+    const kind = sessionForToken(bearerToken(headers.get('Authorization')));
+    if (!kind) {
+      return response;
+    }
+
+    let token;
+    try {
+      token = await refreshSession(kind);
+    } catch (error) {
+      return response;
+    }
+    headers.set('Authorization', `Bearer ${token}`);
+    return originalFetch(input, { ...init, headers });
+  };
+};
+
+// Retry requests that failed with an expired access token after refreshing it once
+export const installAuthRefresh = () => {
+  installAxiosRefresh();
+  installFetchRefresh();
+};
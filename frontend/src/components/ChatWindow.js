@@ -2,6 +2,11 @@ import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import useChat from '../hooks/useChat';
 
+const API_BASE = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+
+// Attachments come back as signed links relative to the API
+const mediaSrc = (url) => (url && url.startsWith('/api/') ? `${API_BASE}${url}` : url);
+
 const ChatMessage = ({ message, currentUserId, onReply }) => {
   const isOwn = message.sender_id === currentUserId;
   const timestamp = new Date(message.timestamp);
@@ -75,9 +80,14 @@ const ChatMessage = ({ message, currentUserId, onReply }) => {
           {message.message_type === 'image' && (
             <div>
               <img
-                src={message.content.media_url}
+                src={mediaSrc(message.content.media_url)}
+                width={message.content.width || undefined}
+                height={message.content.height || undefined}
+                loading="lazy"
                 alt="Shared image"
                 style={{
+                  width: 'auto',
+                  height: 'auto',
                   maxWidth: '100%',
                   maxHeight: '200px',
                   borderRadius: '8px',
@@ -95,8 +105,9 @@ const ChatMessage = ({ message, currentUserId, onReply }) => {
           {message.message_type === 'video' && (
             <div>
               <video
-                src={message.content.media_url}
+                src={mediaSrc(message.content.media_url)}
                 controls
+                preload="metadata"
                 style={{
                   maxWidth: '100%',
                   maxHeight: '200px',
@@ -156,7 +167,6 @@ const ChatWindow = ({ chat, currentUserId, onClose }) => {
   const typingTimeoutRef = useRef(null);
   
   const chatHook = useChat(currentUserId);
-  const API_BASE = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
   
   useEffect(() => {
     if (chat) {
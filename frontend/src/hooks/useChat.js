@@ -1,4 +1,8 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
+import { refreshSession } from '../authSession';
+
+// Close code the server uses when the auth frame is missing or invalid
+const UNAUTHORIZED_CLOSE_CODE = 4401;
 
 const useChat = (userId) => {
   const [socket, setSocket] = useState(null);
@@ -8,6 +12,7 @@ const useChat = (userId) => {
   const [typingUsers, setTypingUsers] = useState({});
   const socketRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
+  const authRetriedRef = useRef(false);
   
   const WEBSOCKET_URL = process.env.REACT_APP_BACKEND_URL?.replace('http', 'ws') || 'ws://localhost:8001';
   
@@ -19,6 +24,8 @@ const useChat = (userId) => {
       socketRef.current = ws;
       
       ws.onopen = () => {
+        // Authenticate before the server sends or accepts anything else
+        ws.send(JSON.stringify({ type: 'auth', token: localStorage.getItem('auth_token') }));
         console.log('WebSocket connected');
         setIsConnected(true);
         setSocket(ws);
@@ -31,6 +38,8 @@ const useChat = (userId) => {
       };
       
       ws.onmessage = (event) => {
+        // The server only sends frames once the auth frame was accepted
+        authRetriedRef.current = false;
         try {
           const data = JSON.parse(event.data);
           handleWebSocketMessage(data);
@@ -39,12 +48,21 @@ const useChat = (userId) => {
         }
       };
       
-      ws.onclose = () => {
+      ws.onclose = (event) => {
         console.log('WebSocket disconnected');
         setIsConnected(false);
         setSocket(null);
         socketRef.current = null;
         
+        if (event.code === UNAUTHORIZED_CLOSE_CODE) {
+          // The access token expired; reconnect once after refreshing it
+          if (!authRetriedRef.current) {
+            authRetriedRef.current = true;
+            refreshSession('user').then(() => connect()).catch(() => {});
+          }
+          return;
+        }
+        
         // Attempt to reconnect after 3 seconds
         reconnectTimeoutRef.current = setTimeout(() => {
           connect();
@@ -70,6 +88,23 @@ const useChat = (userId) => {
         }));
         break;
         
+      case 'sync':
+        // Messages missed while offline, streamed in batches on connect
+        setMessages(prev => {
+          const next = { ...prev };
+          data.data.messages.forEach((syncedMessage) => {
+            const existing = next[syncedMessage.chat_id] || [];
+            if (!existing.some(m => m.id === syncedMessage.id)) {
+              next[syncedMessage.chat_id] = [...existing, syncedMessage];
+            }
+          });
+          return next;
+        });
+        if (data.data.receipts?.length) {
+          console.log('Read receipts:', data.data.receipts);
+        }
+        break;
+
       case 'user_online':
         setOnlineUsers(prev => new Set([...prev, data.data.user_id]));
         break;
@@ -82,6 +117,20 @@ const useChat = (userId) => {
         });
         break;
         
+      case 'presence_update':
+        setOnlineUsers(prev => {
+          const newSet = new Set(prev);
+          data.data.users.forEach(({ user_id, is_online }) => {
+            if (is_online) {
+              newSet.add(user_id);
+            } else {
+              newSet.delete(user_id);
+            }
+          });
+          return newSet;
+        });
+        break;
+
       case 'user_typing':
         const { user_id, chat_id: typingChatId, is_typing } = data.data;
         setTypingUsers(prev => ({
@@ -92,6 +141,13 @@ const useChat = (userId) => {
         }));
         break;
         
+      case 'ping':
+        // Answer the server heartbeat so the connection isn't reaped
+        if (socketRef.current?.readyState === WebSocket.OPEN) {
+          socketRef.current.send(JSON.stringify({ type: 'pong' }));
+        }
+        break;
+        
       case 'message_read':
         // Handle read receipts
         console.log('Message read:', data.data);
@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { useNavigate, Link } from 'react-router-dom';
 import axios from 'axios';
+import { saveSession } from '../authSession';
 
 const LoginPage = () => {
   const [formData, setFormData] = useState({
@@ -28,7 +29,7 @@ const LoginPage = () => {
       const response = await axios.post(`${API_BASE}/api/auth/login`, formData);
       
       if (response.data.success) {
-        localStorage.setItem('auth_token', response.data.token);
+        saveSession('user', response.data.token, response.data.refresh_token);
         localStorage.setItem('user_data', JSON.stringify(response.data.user));
         
         // Role-based redirection
@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import { saveSession } from '../authSession';
 
 const RegisterPage = () => {
   const [formData, setFormData] = useState({
@@ -104,7 +105,7 @@ const RegisterPage = () => {
       console.log('🔐 Registration response:', response.status);
       
       if (response.data.success) {
-        localStorage.setItem('auth_token', response.data.token);
+        saveSession('user', response.data.token, response.data.refresh_token);
         localStorage.setItem('user_data', JSON.stringify(response.data.user));
         
         // Role-based redirection with success message